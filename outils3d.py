@@ -0,0 +1,1528 @@
+"""
+Outils partagés par les TP : lecture et écriture PLY, cache disque des meshes prétraités, calcul des
+normales par lots, BVH et sélection à la souris, rendu GPU (modèles, instanciation) et mode repos.
+Les scripts des dossiers tp1, tp2 et tp3 l'importent depuis la racine du dépôt.
+"""
+import pyray as pr
+import os
+import json
+import shutil
+import tempfile
+import hashlib
+import math
+import numpy as np
+from pyray import Vector3
+import trimesh
+
+# Types scalaires PLY -> types NumPy (sans ordre des octets)
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+PLY_BYTE_ORDERS = {"ascii": "=", "binary_little_endian": "<", "binary_big_endian": ">"}
+
+PLY_FACE_LISTS = ("vertex_indices", "vertex_index")
+
+def read_ply_header(file_path):
+    """
+    Lit l'en-tête d'un fichier PLY.
+
+    :return: Dictionnaire avec le format ("ascii", "binary_little_endian" ou "binary_big_endian"),
+             la position du premier octet de données et la liste des éléments. Chaque élément est un
+             dictionnaire (name, count, properties) ; une propriété est (nom, type) pour un scalaire
+             ou (nom, (type du compteur, type des valeurs)) pour une liste.
+    """
+    header = {"format": None, "elements": []}
+    with open(file_path, "rb") as file:
+        if file.readline().strip() != b"ply":
+            raise ValueError(f"{file_path} n'est pas un fichier PLY")
+        while True:
+            line = file.readline()
+            if not line:
+                raise ValueError(f"{file_path} : en-tête PLY sans end_header")
+            words = line.decode("ascii").split()
+            if not words or words[0] in ("comment", "obj_info"):
+                continue
+            if words[0] == "end_header":
+                break
+            if words[0] == "format":
+                if words[1] not in PLY_BYTE_ORDERS:
+                    raise ValueError(f"{file_path} : format PLY inconnu {words[1]}")
+                header["format"] = words[1]
+            elif words[0] == "element":
+                header["elements"].append({"name": words[1], "count": int(words[2]), "properties": []})
+            elif words[0] == "property" and words[1] == "list":
+                header["elements"][-1]["properties"].append((words[4], (PLY_TYPES[words[2]], PLY_TYPES[words[3]])))
+            elif words[0] == "property":
+                header["elements"][-1]["properties"].append((words[2], PLY_TYPES[words[1]]))
+        header["data_offset"] = file.tell()
+    return header
+
+def ply_element_dtype(element, byte_order, list_lengths):
+    """Type structuré d'un élément PLY dont chaque liste a une longueur fixe (list_lengths[nom])."""
+    fields = []
+    for name, kind in element["properties"]:
+        if isinstance(kind, tuple):
+            fields.append((name + "_count", byte_order + kind[0]))
+            fields.append((name, byte_order + kind[1], (list_lengths[name],)))
+        else:
+            fields.append((name, byte_order + kind))
+    return np.dtype(fields)
+
+PLY_CHECK_CHUNK = 1 << 16  # Nombre d'enregistrements vérifiés à la fois par ply_lists_are_uniform
+
+def ply_lists_are_uniform(records, element, list_lengths, chunk_size=PLY_CHECK_CHUNK):
+    """
+    Vérifie que toutes les listes de l'élément ont bien la longueur supposée. Les compteurs sont comparés
+    par blocs de chunk_size : sur un élément projeté en mémoire, la mémoire utilisée ne dépend pas du
+    nombre d'enregistrements.
+    """
+    for name, kind in element["properties"]:
+        if not isinstance(kind, tuple):
+            continue
+        counts = records[name + "_count"]
+        for start in range(0, len(counts), chunk_size):
+            if not np.all(counts[start:start + chunk_size] == list_lengths[name]):
+                return False
+    return True
+
+def read_ply_binary_element(file_path, element, byte_order, offset):
+    """
+    Lit un élément PLY binaire. Sans liste, ou si toutes les listes ont la même longueur que dans le
+    premier enregistrement (cas des maillages triangulés), l'élément est projeté en mémoire (np.memmap)
+    comme un tableau structuré, sans copie. Sinon les enregistrements sont décodés un par un.
+
+    :return: Tuple (enregistrements, position de l'élément suivant).
+    """
+    lists = [(name, kind) for name, kind in element["properties"] if isinstance(kind, tuple)]
+    list_lengths = {}
+    if lists and element["count"] > 0:
+        # Longueurs des listes du premier enregistrement
+        with open(file_path, "rb") as file:
+            file.seek(offset)
+            for name, kind in element["properties"]:
+                if isinstance(kind, tuple):
+                    count_type = np.dtype(byte_order + kind[0])
+                    length = int(np.frombuffer(file.read(count_type.itemsize), dtype=count_type)[0])
+                    list_lengths[name] = length
+                    file.seek(length * np.dtype(kind[1]).itemsize, 1)
+                else:
+                    file.seek(np.dtype(kind).itemsize, 1)
+    else:
+        list_lengths = {name: 0 for name, _ in lists}
+
+    dtype = ply_element_dtype(element, byte_order, list_lengths)
+    if element["count"] == 0:
+        return np.empty(0, dtype=dtype), offset
+    # Si le premier polygone est plus grand que les suivants, la taille supposée dépasse la fin du fichier :
+    # on ne projette que si elle tient, sinon on passe directement au décodage séquentiel
+    end = offset + element["count"] * dtype.itemsize
+    if end <= os.path.getsize(file_path):
+        records = np.memmap(file_path, dtype=dtype, mode="r", offset=offset, shape=(element["count"],))
+        if ply_lists_are_uniform(records, element, list_lengths):
+            return records, end
+
+    # Listes de longueurs variables (polygones mélangés) : décodage séquentiel
+    with open(file_path, "rb") as file:
+        file.seek(offset)
+        data = file.read()
+    position = 0
+    records = {name: [] for name, _ in element["properties"]}
+    for _ in range(element["count"]):
+        for name, kind in element["properties"]:
+            if isinstance(kind, tuple):
+                count_type = np.dtype(byte_order + kind[0])
+                item_type = np.dtype(byte_order + kind[1])
+                length = int(np.frombuffer(data, dtype=count_type, count=1, offset=position)[0])
+                position += count_type.itemsize
+                records[name].append(np.frombuffer(data, dtype=item_type, count=length, offset=position))
+                position += length * item_type.itemsize
+            else:
+                value_type = np.dtype(byte_order + kind)
+                records[name].append(np.frombuffer(data, dtype=value_type, count=1, offset=position)[0])
+                position += value_type.itemsize
+    return records, offset + position
+
+def read_ply_ascii_element(values, element, position):
+    """
+    Lit un élément PLY ASCII à partir de toutes les valeurs du corps du fichier déjà converties en
+    un seul tableau de nombres. Même logique que read_ply_binary_element : découpage en bloc si les
+    listes ont une longueur fixe, décodage séquentiel sinon.
+
+    :return: Tuple (enregistrements, position de l'élément suivant dans values).
+    """
+    list_lengths = {}
+    cursor = position
+    for name, kind in element["properties"]:
+        if isinstance(kind, tuple):
+            list_lengths[name] = int(values[cursor]) if element["count"] > 0 else 0
+            cursor += 1 + list_lengths[name]
+        else:
+            cursor += 1
+    record_size = cursor - position
+    dtype = ply_element_dtype(element, "=", list_lengths)
+    end = position + element["count"] * record_size
+    if end <= len(values):
+        block = values[position:end].reshape(element["count"], record_size)
+        records = np.empty(element["count"], dtype=dtype)
+        column = 0
+        for name in dtype.names:
+            width = int(np.prod(dtype[name].shape))
+            records[name] = block[:, column:column + width].reshape((-1,) + dtype[name].shape)
+            column += width
+        if ply_lists_are_uniform(records, element, list_lengths):
+            return records, end
+
+    records = {name: [] for name, _ in element["properties"]}
+    cursor = position
+    for _ in range(element["count"]):
+        for name, kind in element["properties"]:
+            if isinstance(kind, tuple):
+                length = int(values[cursor])
+                records[name].append(values[cursor + 1:cursor + 1 + length].astype(kind[1]))
+                cursor += 1 + length
+            else:
+                records[name].append(values[cursor].astype(kind))
+                cursor += 1
+    return records, cursor
+
+def ply_faces_to_triangles(records):
+    """
+    Extrait les faces triangulaires (F,3) int32 d'un élément face lu par read_ply. Les polygones
+    sont découpés en éventail (0, i, i+1), de façon vectorisée quand ils ont tous le même nombre de sommets.
+    """
+    names = records.dtype.names if isinstance(records, np.ndarray) else tuple(records)
+    name = next(name for name in PLY_FACE_LISTS if name in names)
+    if isinstance(records, np.ndarray):
+        polygons = np.asarray(records[name], dtype=np.int32)
+        if polygons.shape[1] == 3:
+            return np.ascontiguousarray(polygons)
+        fans = [polygons[:, [0, i, i + 1]] for i in range(1, polygons.shape[1] - 1)]
+        return np.stack(fans, axis=1).reshape(-1, 3) if fans else np.empty((0, 3), dtype=np.int32)
+    triangles = [polygon[[0, i, i + 1]] for polygon in records[name] for i in range(1, len(polygon) - 1)]
+    return np.array(triangles, dtype=np.int32).reshape(-1, 3)
+
+def read_ply(file_path, decode_faces=True):
+    """
+    Lecteur PLY natif (ASCII, binaire little endian et big endian), sans passer par trimesh.load.
+
+    En binaire, les éléments sans liste (les sommets) et les éléments dont toutes les listes ont la même
+    longueur (les faces d'un maillage triangulé) sont projetés en mémoire comme tableaux structurés NumPy,
+    sans copie ni travail Python par face. En ASCII, tout le corps du fichier est converti en nombres en
+    un seul appel puis découpé par élément.
+
+    :param decode_faces: Si False, les faces ne sont pas converties en triangles ("faces" vaut None) :
+                         l'élément face reste projeté en mémoire, pour un traitement par blocs.
+    :return: Dictionnaire {"header": en-tête, "elements": {nom: enregistrements},
+             "vertex": enregistrements des sommets, "faces": triangles (F,3) int32}.
+    """
+    header = read_ply_header(file_path)
+    byte_order = PLY_BYTE_ORDERS[header["format"]]
+    elements = {}
+    if header["format"] == "ascii":
+        with open(file_path, "rb") as file:
+            file.seek(header["data_offset"])
+            values = np.fromstring(file.read().decode("ascii"), sep=" ")
+        position = 0
+        for element in header["elements"]:
+            elements[element["name"]], position = read_ply_ascii_element(values, element, position)
+    else:
+        offset = header["data_offset"]
+        for element in header["elements"]:
+            elements[element["name"]], offset = read_ply_binary_element(file_path, element, byte_order, offset)
+
+    faces = np.empty((0, 3), dtype=np.int32)
+    if not decode_faces:
+        faces = None
+    elif "face" in elements:
+        faces = ply_faces_to_triangles(elements["face"])
+    return {"header": header, "elements": elements, "vertex": elements.get("vertex"), "faces": faces}
+
+def load_ply_file(file_path):
+    """
+    Charge un fichier PLY et retourne le mesh en tant que structure de données trimesh.
+    Le fichier est lu par read_ply ; les sommets sont convertis une seule fois en float64 (format de trimesh)
+    et le mesh est construit sans traitement (process=False), les sommets restent donc dans l'ordre du fichier.
+    """
+    data = read_ply(file_path)
+    vertex = data["vertex"]
+    vertices = np.empty((len(vertex["x"]), 3))
+    for axis, name in enumerate(("x", "y", "z")):
+        vertices[:, axis] = vertex[name]
+    mesh = trimesh.Trimesh(vertices=vertices, faces=data["faces"], process=False)
+    return mesh
+
+PLY_WRITE_CHUNK = 1 << 16  # Nombre de sommets ou de faces écrits à la fois
+
+def write_ply_chunks(file, array, dtype, binary, count_prefix=None, chunk_size=PLY_WRITE_CHUNK):
+    """
+    Écrit les lignes d'un tableau (N,k) par blocs de chunk_size : un tampon de taille fixe est réutilisé,
+    la mémoire supplémentaire ne dépend donc pas de N.
+
+    :param dtype: Type structuré d'un enregistrement binaire (champ "count" optionnel puis champ "values").
+    :param count_prefix: Nombre écrit en tête de chaque ligne (taille des listes de faces), ou None.
+    """
+    buffer = np.empty(min(chunk_size, max(len(array), 1)), dtype=dtype)
+    if count_prefix is not None:
+        buffer["count"] = count_prefix
+    for start in range(0, len(array), chunk_size):
+        chunk = np.asarray(array[start:start + chunk_size])
+        if binary:
+            records = buffer[:len(chunk)]
+            records["values"] = chunk
+            file.write(memoryview(records).cast("B"))
+        else:
+            if count_prefix is not None:
+                chunk = np.column_stack((np.full(len(chunk), count_prefix), chunk))
+            kind = "%d" if np.issubdtype(chunk.dtype, np.integer) else "%.9g"
+            line = " ".join([kind] * chunk.shape[1]) + "\n"
+            file.write(((line * len(chunk)) % tuple(chunk.ravel().tolist())).encode("ascii"))
+
+def write_ply(file_path, vertices, faces, normals=None, binary=True, chunk_size=PLY_WRITE_CHUNK, transform=None):
+    """
+    Écrit un mesh au format PLY en flux, par blocs de taille fixe, depuis des tableaux NumPy
+    (éventuellement projetés en mémoire) : la mémoire supplémentaire est constante.
+
+    :param vertices: Tableau (V,3) des sommets (écrits en float).
+    :param faces: Tableau (F,3) des triangles (écrits en list uchar int).
+    :param normals: Tableau (V,3) optionnel des normales des sommets (propriétés nx, ny, nz), écrites telles quelles.
+    :param binary: True pour binary_little_endian, False pour ASCII.
+    :param chunk_size: Nombre de sommets ou de faces par bloc.
+    :param transform: Matrice affine 4x4 optionnelle appliquée aux sommets, bloc par bloc.
+    """
+    vertex_count, face_count = len(vertices), len(faces)
+    properties = ["x", "y", "z"] + (["nx", "ny", "nz"] if normals is not None else [])
+    header = ["ply", f"format {'binary_little_endian' if binary else 'ascii'} 1.0", "comment 3DmathPythonModeling",
+              f"element vertex {vertex_count}"]
+    header += [f"property float {name}" for name in properties]
+    header += [f"element face {face_count}", "property list uchar int vertex_indices", "end_header"]
+
+    vertex_dtype = np.dtype([("values", "<f4", (len(properties),))])
+    face_dtype = np.dtype([("count", "u1"), ("values", "<i4", (3,))])
+    with open(file_path, "wb") as file:
+        file.write(("\n".join(header) + "\n").encode("ascii"))
+        for start in range(0, vertex_count, chunk_size):
+            # Sommets et normales assemblés bloc par bloc
+            chunk = vertices[start:start + chunk_size]
+            if transform is not None:
+                chunk = transform_points(transform, chunk)
+            chunk = np.asarray(chunk, dtype=np.float32)
+            if normals is not None:
+                chunk = np.hstack((chunk, np.asarray(normals[start:start + chunk_size], dtype=np.float32)))
+            write_ply_chunks(file, chunk, vertex_dtype, binary, chunk_size=chunk_size)
+        write_ply_chunks(file, faces, face_dtype, binary, count_prefix=3, chunk_size=chunk_size)
+
+def export_mesh(mesh, file_path, binary=True, with_normals=False, normals=None, chunk_size=PLY_WRITE_CHUNK):
+    """
+    Enregistre le mesh tel qu'il est affiché : sommets transformés par sa matrice de modèle ou par
+    apply_transformations, avec en option les normales des sommets. La matrice est appliquée bloc par bloc
+    pendant l'écriture : aucune copie transformée des sommets n'est gardée en mémoire.
+
+    :param with_normals: Si True et normals est None, les normales des sommets sont calculées dans l'espace
+                         du monde par blocs de faces (accumulate_normals_in_chunks) dans un .npy temporaire
+                         projeté en mémoire.
+    :param normals: Tableau (V,3) optionnel de normales déjà calculées dans l'espace du monde (par exemple
+                    celles de compute_normals_out_of_core), écrites telles quelles.
+    """
+    vertices = np.asarray(mesh.vertices)
+    faces = np.asarray(mesh.faces)
+    transform = get_mesh_transform(mesh)
+    if normals is not None or not with_normals:
+        write_ply(file_path, vertices, faces, normals, binary, chunk_size, transform)
+        return
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        normals = np.lib.format.open_memmap(os.path.join(temp_dir, "vertex_normals.npy"), mode="w+",
+                                            dtype=np.float64, shape=vertices.shape)
+        accumulate_normals_in_chunks(vertices.T, faces, normals, chunk_size=chunk_size, transform=transform)
+        write_ply(file_path, vertices, faces, normals, binary, chunk_size, transform)
+        del normals  # Le fichier projeté doit être fermé avant la suppression du répertoire
+
+MESH_CACHE_DIR = os.environ.get("MESH_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "3dmath_meshes"))
+
+MESH_CACHE_MAX_BYTES = 2 << 30  # Taille maximale du répertoire de cache (2 Gio), entrées les moins récemment utilisées évincées
+
+MESH_CACHE_VERSION = 1
+
+MESH_CACHE_ARRAYS = ("vertices", "faces", "edges", "face_centers", "face_normals", "vertex_normals")
+
+def file_content_hash(file_path, block_size=1 << 22):
+    """Empreinte BLAKE2b du contenu d'un fichier, lu par blocs."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def mesh_cache_key(file_path):
+    """Clé de cache d'un fichier PLY : chemin absolu, taille, date de modification et empreinte du contenu."""
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    identity = f"{path}|{stat.st_size}|{stat.st_mtime_ns}|{file_content_hash(path)}|{MESH_CACHE_VERSION}"
+    return hashlib.blake2b(identity.encode("utf-8"), digest_size=16).hexdigest()
+
+def write_mesh_cache_entry(entry_dir, file_path, arrays):
+    """Écrit une entrée de cache (un .npy par tableau) dans un répertoire temporaire puis la publie d'un coup."""
+    temporary_dir = f"{entry_dir}.tmp-{os.getpid()}"
+    os.makedirs(temporary_dir, exist_ok=True)
+    for name in MESH_CACHE_ARRAYS:
+        np.save(os.path.join(temporary_dir, name + ".npy"), arrays[name])
+    with open(os.path.join(temporary_dir, "meta.json"), "w") as file:
+        json.dump({"source": os.path.abspath(file_path), "version": MESH_CACHE_VERSION}, file)
+    try:
+        os.rename(temporary_dir, entry_dir)
+    except OSError:
+        # Une autre instance a publié la même entrée entre-temps
+        shutil.rmtree(temporary_dir, ignore_errors=True)
+
+def evict_mesh_cache(cache_dir, max_bytes, keep=None):
+    """Supprime les entrées les moins récemment utilisées jusqu'à ce que le cache tienne dans max_bytes."""
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if not os.path.isdir(entry_dir) or ".tmp-" in name:
+            continue
+        size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+        entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        if entry_dir == keep:
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+def load_cached_mesh(file_path, cache_dir=None, max_bytes=MESH_CACHE_MAX_BYTES):
+    """
+    Charge un fichier PLY en passant par un cache disque des données prétraitées : sommets, faces,
+    arêtes uniques, centres et normales des faces, normales des sommets. Au premier chargement le
+    fichier est lu par read_ply et les données calculées sont enregistrées en .npy ; les chargements
+    suivants projettent ces fichiers en mémoire (np.load en mmap_mode) au lieu de relire le PLY.
+
+    Les sommets (float64) et les faces (int64) sont stockés au format de trimesh pour être utilisés sans copie.
+
+    :param file_path: Chemin du fichier PLY.
+    :param cache_dir: Répertoire du cache (MESH_CACHE_DIR si None).
+    :param max_bytes: Taille maximale du cache ; au-delà les entrées les moins récemment utilisées sont supprimées.
+    :return: Tuple (mesh trimesh, dictionnaire des tableaux du cache).
+    """
+    cache_dir = MESH_CACHE_DIR if cache_dir is None else cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, mesh_cache_key(file_path))
+
+    if not os.path.isdir(entry_dir):
+        mesh = load_ply_file(file_path)
+        vertices = np.asarray(mesh.vertices, dtype=np.float64)
+        faces = np.asarray(mesh.faces, dtype=np.int64)
+        face_centers, face_normals = compute_face_normals_array(vertices, faces)
+        write_mesh_cache_entry(entry_dir, file_path, {
+            "vertices": vertices,
+            "faces": faces,
+            "edges": compute_unique_edges(faces),
+            "face_centers": face_centers,
+            "face_normals": face_normals,
+            "vertex_normals": compute_vertex_normals_array(vertices, faces, face_normals),
+        })
+        evict_mesh_cache(cache_dir, max_bytes, keep=entry_dir)
+    else:
+        os.utime(entry_dir)  # Entrée la plus récemment utilisée pour l'éviction LRU
+
+    arrays = {name: np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="r") for name in MESH_CACHE_ARRAYS}
+    mesh = trimesh.Trimesh(vertices=arrays["vertices"], faces=arrays["faces"], process=False)
+    # Les arêtes uniques sont déjà connues : get_unique_edges n'aura pas à les recalculer
+    mesh.unique_edges_cache = {"faces_hash": hash(mesh.faces), "edges": arrays["edges"]}
+    return mesh, arrays
+
+VERTEX_NORMAL_WEIGHTINGS = ("uniform", "area", "angle")
+
+def vertex_normal_corner_weights(corners, weighting):
+    """Poids (F,3) de la normale de chaque face pour chacun de ses trois coins (corners : (F,3,3))."""
+    if weighting == "uniform":
+        return np.ones(corners.shape[:2])
+    if weighting == "area":
+        cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        areas = 0.5 * np.sqrt(np.einsum('ij,ij->i', cross, cross))
+        return np.repeat(areas[:, np.newaxis], 3, axis=1)
+    # Angle au coin k entre les arêtes vers les coins k+1 et k+2
+    to_next = np.roll(corners, -1, axis=1) - corners
+    to_prev = np.roll(corners, 1, axis=1) - corners
+    sin_part = np.linalg.norm(np.cross(to_next, to_prev), axis=2)
+    cos_part = np.einsum('ijk,ijk->ij', to_next, to_prev)
+    return np.arctan2(sin_part, cos_part)
+
+def compute_vertex_normals_array(vertices, faces, face_normals=None, weighting="uniform"):
+    """
+    Calcule les normales des sommets par accumulation (scatter-add) des normales des faces adjacentes.
+
+    :param vertices: Tableau (V,3) des sommets.
+    :param faces: Tableau (F,3) des indices de sommets de chaque face.
+    :param face_normals: Tableau (F,3) des normales unitaires des faces (calculé si None).
+    :param weighting: "uniform" (moyenne simple), "area" (pondération par l'aire des faces)
+                      ou "angle" (pondération par l'angle au coin de chaque face).
+    :return: Tableau (V,3) des normales unitaires ; nul pour les sommets isolés.
+    """
+    if weighting not in VERTEX_NORMAL_WEIGHTINGS:
+        raise ValueError(f"Pondération inconnue : {weighting!r} (attendu : {', '.join(VERTEX_NORMAL_WEIGHTINGS)})")
+
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    if face_normals is None:
+        _, face_normals = compute_face_normals_array(vertices, faces)
+    face_normals = np.asarray(face_normals, dtype=np.float64)
+
+    corner_weights = vertex_normal_corner_weights(vertices[faces], weighting)
+
+    # Accumulation par composante : une seule passe sur les coins des faces
+    contributions = (face_normals[:, np.newaxis, :] * corner_weights[:, :, np.newaxis]).reshape(-1, 3)
+    vertex_indices = faces.ravel()
+    nb_vertices = len(vertices)
+    vertex_normals = np.empty((nb_vertices, 3))
+    for axis in range(3):
+        vertex_normals[:, axis] = np.bincount(vertex_indices, weights=contributions[:, axis], minlength=nb_vertices)
+
+    lengths = np.sqrt(np.einsum('ij,ij->i', vertex_normals, vertex_normals))
+    valid = lengths != 0
+    vertex_normals[valid] /= lengths[valid, np.newaxis]
+    vertex_normals[~valid] = 0.0
+    return vertex_normals
+
+def compute_face_normals_array(vertices, faces):
+    """
+    Calcule en un seul passage NumPy les centres et les normales unitaires de toutes les faces.
+
+    :param vertices: Tableau (V,3) des sommets.
+    :param faces: Tableau (F,3) des indices de sommets de chaque face.
+    :return: Tuple (centres, normales) de deux tableaux contigus (F,3) en float64.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces)
+    v0 = vertices[faces[:, 0]]
+    v1 = vertices[faces[:, 1]]
+    v2 = vertices[faces[:, 2]]
+
+    normals = np.cross(v1 - v0, v2 - v0)
+    lengths = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+
+    # Les faces dégénérées gardent une normale nulle, comme dans vector_normalize
+    valid = lengths != 0
+    normals[valid] /= lengths[valid, np.newaxis]
+    normals[~valid] = 0.0
+
+    centers = (v0 + v1 + v2) / 3
+    return centers, normals
+
+NORMALS_CHUNK = 1 << 20  # Nombre de faces traitées à la fois par compute_normals_out_of_core
+
+def compute_normals_out_of_core(ply_path, face_normals_path, vertex_normals_path, weighting="uniform",
+                                chunk_size=NORMALS_CHUNK):
+    """
+    Calcule les normales des faces et des sommets d'un fichier PLY trop gros pour la mémoire.
+    Les faces sont lues par blocs de chunk_size depuis le fichier projeté en mémoire (read_ply), les
+    normales des faces sont écrites dans un .npy projeté en mémoire et celles des sommets sont accumulées
+    dans un second .npy (V,3) projeté en mémoire : la mémoire anonyme utilisée dépend de chunk_size,
+    pas de la taille du mesh. Mêmes résultats que compute_face_normals_array / compute_vertex_normals_array.
+
+    Les blocs de faces de tailles mélangées (décodés séquentiellement par read_ply) sont chargés en entier.
+
+    :param ply_path: Fichier PLY source (binaire pour profiter de la projection en mémoire).
+    :param face_normals_path: Fichier .npy de sortie (T,3) float32 des normales unitaires des triangles.
+    :param vertex_normals_path: Fichier .npy de sortie (V,3) float64 des normales unitaires des sommets.
+    :param weighting: Pondération des normales des sommets (voir VERTEX_NORMAL_WEIGHTINGS).
+    :param chunk_size: Nombre de faces par bloc.
+    :return: Tuple (normales des faces, normales des sommets) projetés en mémoire.
+    """
+    if weighting not in VERTEX_NORMAL_WEIGHTINGS:
+        raise ValueError(f"Pondération inconnue : {weighting!r} (attendu : {', '.join(VERTEX_NORMAL_WEIGHTINGS)})")
+
+    data = read_ply(ply_path, decode_faces=False)
+    vertex = data["vertex"]
+    coordinates = [vertex[name] for name in ("x", "y", "z")]
+    nb_vertices = len(coordinates[0])
+    records = data["elements"]["face"]
+    if isinstance(records, np.ndarray):
+        polygon_size = records.dtype[next(name for name in PLY_FACE_LISTS if name in records.dtype.names)].shape[0]
+        nb_triangles = len(records) * max(polygon_size - 2, 0)
+    else:
+        records = ply_faces_to_triangles(records)
+        nb_triangles = len(records)
+
+    face_normals = np.lib.format.open_memmap(face_normals_path, mode="w+", dtype=np.float32, shape=(nb_triangles, 3))
+    vertex_normals = np.lib.format.open_memmap(vertex_normals_path, mode="w+", dtype=np.float64, shape=(nb_vertices, 3))
+    accumulate_normals_in_chunks(coordinates, records, vertex_normals, face_normals, weighting, chunk_size)
+    face_normals.flush()
+    vertex_normals.flush()
+    return face_normals, vertex_normals
+
+def accumulate_normals_in_chunks(coordinates, records, vertex_normals, face_normals=None, weighting="uniform",
+                                 chunk_size=NORMALS_CHUNK, transform=None):
+    """
+    Calcule les normales par blocs de chunk_size faces dans des tableaux de sortie fournis (éventuellement
+    projetés en mémoire) : seuls les coins des faces d'un bloc sont rassemblés, la mémoire anonyme utilisée
+    dépend de chunk_size et pas de la taille du mesh.
+
+    :param coordinates: Suite de trois tableaux (V,) des coordonnées x, y et z des sommets.
+    :param records: Faces (T,3) ou enregistrements PLY de polygones (triangulés bloc par bloc).
+    :param vertex_normals: Tableau (V,3) de sortie des normales unitaires des sommets.
+    :param face_normals: Tableau (T,3) optionnel de sortie des normales unitaires des triangles.
+    :param weighting: Pondération des normales des sommets (voir VERTEX_NORMAL_WEIGHTINGS).
+    :param chunk_size: Nombre de faces par bloc.
+    :param transform: Matrice affine 4x4 optionnelle appliquée aux coins de chaque bloc : normales de
+                      l'espace du monde, sans copie transformée de tous les sommets.
+    """
+    vertex_normals[:] = 0.0
+    written = 0
+    for start in range(0, len(records), chunk_size):
+        block = records[start:start + chunk_size]
+        triangles = ply_faces_to_triangles(block) if block.dtype.names else block
+        triangles = triangles.astype(np.int64)
+        corners = np.empty(triangles.shape + (3,))
+        for axis in range(3):
+            corners[:, :, axis] = coordinates[axis][triangles]
+        if transform is not None:
+            corners = corners @ transform[:3, :3].T + transform[:3, 3]
+
+        normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+        lengths = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+        valid = lengths != 0
+        normals[valid] /= lengths[valid, np.newaxis]
+        normals[~valid] = 0.0
+        if face_normals is not None:
+            face_normals[written:written + len(triangles)] = normals
+        written += len(triangles)
+
+        # Somme des contributions par sommet dans le bloc, puis une seule mise à jour de l'accumulateur
+        weights = vertex_normal_corner_weights(corners, weighting)
+        contributions = (normals[:, np.newaxis, :] * weights[:, :, np.newaxis]).reshape(-1, 3)
+        indices = triangles.ravel()
+        order = np.argsort(indices, kind="stable")
+        sorted_indices = indices[order]
+        starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        touched = sorted_indices[starts]
+        vertex_normals[touched] += np.add.reduceat(contributions[order], starts, axis=0)
+
+    # Normalisation par blocs de sommets
+    for start in range(0, len(vertex_normals), chunk_size):
+        block = vertex_normals[start:start + chunk_size]
+        lengths = np.sqrt(np.einsum('ij,ij->i', block, block))
+        valid = lengths != 0
+        block[valid] /= lengths[valid, np.newaxis]
+        block[~valid] = 0.0
+
+BVH_LEAF_SIZE = 8  # Nombre maximal de faces par feuille du BVH
+
+BARYCENTRIC_TOLERANCE = 1e-9
+
+def morton_codes(points):
+    """Codes de Morton (entrelacement des bits, 10 bits par axe) de points normalisés dans leur boîte englobante."""
+    lo = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lo, 1e-12)
+    quantized = np.clip(((points - lo) / extent * 1023).astype(np.int64), 0, 1023)
+    codes = np.zeros(len(points), dtype=np.int64)
+    for bit in range(10):
+        for axis in range(3):
+            codes |= ((quantized[:, axis] >> bit) & 1) << (3 * bit + (2 - axis))
+    return codes
+
+def build_bvh(vertices, faces, leaf_size=BVH_LEAF_SIZE):
+    """
+    Construit un BVH (hiérarchie de boîtes englobantes) sur les faces d'un mesh.
+    Les faces sont triées selon le code de Morton de leur centre puis regroupées en feuilles
+    de leaf_size faces ; l'arbre binaire complet au-dessus des feuilles est implicite
+    (enfants du nœud i : 2i+1 et 2i+2), ce qui permet de tout calculer par lots NumPy.
+
+    :return: Dictionnaire décrivant le BVH.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    nb_leaves = max(1, -(-len(faces) // leaf_size))
+    depth = int(math.ceil(math.log2(nb_leaves)))
+    if len(faces):
+        order = np.argsort(morton_codes(vertices[faces].mean(axis=1)), kind="stable")
+    else:
+        order = np.empty(0, dtype=np.int64)
+    bvh = {
+        "faces": faces[order],
+        "face_ids": order,
+        "leaf_size": leaf_size,
+        "depth": depth,
+        "first_leaf": (1 << depth) - 1,
+        "node_min": np.full(((1 << (depth + 1)) - 1, 3), np.inf),
+        "node_max": np.full(((1 << (depth + 1)) - 1, 3), -np.inf),
+    }
+    refit_bvh(bvh, vertices)
+    return bvh
+
+def refit_bvh(bvh, vertices):
+    """Recalcule les boîtes du BVH pour de nouvelles positions de sommets, sans changer sa structure."""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    corners = vertices[bvh["faces"]]
+    bvh["v0"] = np.ascontiguousarray(corners[:, 0])  # Contigu : lu à plat par intersect_ray_bvh
+    bvh["edge1"] = corners[:, 1] - corners[:, 0]
+    bvh["edge2"] = corners[:, 2] - corners[:, 0]
+
+    node_min = bvh["node_min"]
+    node_max = bvh["node_max"]
+    first_leaf = bvh["first_leaf"]
+    if len(corners):
+        starts = np.arange(0, len(corners), bvh["leaf_size"])
+        node_min[first_leaf:first_leaf + len(starts)] = np.minimum.reduceat(corners.min(axis=1), starts)
+        node_max[first_leaf:first_leaf + len(starts)] = np.maximum.reduceat(corners.max(axis=1), starts)
+    # Remontée niveau par niveau : chaque nœud englobe ses deux enfants
+    for level in range(bvh["depth"] - 1, -1, -1):
+        nodes = np.arange((1 << level) - 1, (1 << (level + 1)) - 1)
+        node_min[nodes] = np.minimum(node_min[2 * nodes + 1], node_min[2 * nodes + 2])
+        node_max[nodes] = np.maximum(node_max[2 * nodes + 1], node_max[2 * nodes + 2])
+    return bvh
+
+def get_mesh_bvh(mesh):
+    """
+    Retourne le BVH du mesh, construit une seule fois par topologie et
+    réajusté (refit) seulement quand mesh.vertices change.
+    """
+    faces_hash = hash(mesh.faces)
+    vertices_hash = hash(mesh.vertices)
+    cache = getattr(mesh, "bvh_cache", None)
+    if cache is None or cache["faces_hash"] != faces_hash:
+        cache = mesh.bvh_cache = {"bvh": build_bvh(mesh.vertices, mesh.faces), "faces_hash": faces_hash}
+    elif cache["vertices_hash"] != vertices_hash:
+        refit_bvh(cache["bvh"], mesh.vertices)
+    cache["vertices_hash"] = vertices_hash
+    return cache["bvh"]
+
+def intersect_rays_bvh(bvh, origins, directions, t_min=0.0, t_max=np.inf):
+    """
+    Intersecte un lot de rayons o + t*d avec les faces du BVH (test de Möller-Trumbore, faces à double face).
+    Le parcours avance niveau par niveau sur tous les couples (rayon, nœud) à la fois.
+
+    :param origins: Tableau (R,3) des origines.
+    :param directions: Tableau (R,3) des directions (non nécessairement unitaires).
+    :param t_min: Paramètre minimal accepté (scalaire ou (R,)).
+    :param t_max: Paramètre maximal accepté (scalaire ou (R,)).
+    :return: Tuple (t, faces, barycentriques) : t (R,) vaut inf sans impact, faces (R,) les indices
+             des faces touchées (-1 sinon), barycentriques (R,2) les coordonnées (u, v) de l'impact.
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    nb_rays = len(origins)
+    t_min = np.broadcast_to(np.asarray(t_min, dtype=np.float64), (nb_rays,))
+    best_t = np.broadcast_to(np.asarray(t_max, dtype=np.float64), (nb_rays,)).copy()
+    best_face = np.full(nb_rays, -1, dtype=np.int64)
+    best_uv = np.zeros((nb_rays, 2))
+
+    # Évite les divisions par zéro dans le test des boîtes (méthode des tranches)
+    safe_directions = np.where(directions == 0, 1e-300, directions)
+    inverse_directions = 1.0 / safe_directions
+    nb_faces = len(bvh["faces"])
+    leaf_size = bvh["leaf_size"]
+    first_leaf = bvh["first_leaf"]
+
+    rays = np.arange(nb_rays)
+    nodes = np.zeros(nb_rays, dtype=np.int64)
+    level = 0
+    with np.errstate(invalid="ignore", over="ignore"):
+        while len(rays):
+            node_min = bvh["node_min"][nodes]
+            node_max = bvh["node_max"][nodes]
+            ray_origins = origins[rays]
+            ray_inverses = inverse_directions[rays]
+            t1 = (node_min - ray_origins) * ray_inverses
+            t2 = (node_max - ray_origins) * ray_inverses
+            t_near = np.minimum(t1, t2).max(axis=1)
+            t_far = np.maximum(t1, t2).min(axis=1)
+            # Les nœuds vides (boîte inversée, sans face) ne doivent jamais être traversés
+            hit = ((node_min[:, 0] <= node_max[:, 0]) & (t_near <= t_far)
+                   & (t_far >= t_min[rays]) & (t_near <= best_t[rays]))
+            rays = rays[hit]
+            nodes = nodes[hit]
+            if level < bvh["depth"]:
+                # Nœuds internes : on descend de deux niveaux d'un coup (quatre petits-enfants) quand c'est possible
+                step = 2 if bvh["depth"] - level >= 2 else 1
+                fan_out = 1 << step
+                rays = np.repeat(rays, fan_out)
+                nodes = (np.repeat(nodes, fan_out) + 1) * fan_out - 1 + np.tile(np.arange(fan_out), len(nodes))
+                level += step
+                continue
+
+            # Feuilles : on développe chaque couple (rayon, feuille) en couples (rayon, face)
+            starts = (nodes - first_leaf) * leaf_size
+            counts = np.clip(nb_faces - starts, 0, leaf_size)
+            total = int(counts.sum())
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+            pair_faces = offsets + np.arange(total)
+            pair_rays = np.repeat(rays, counts)
+
+            d = directions[pair_rays]
+            edge1 = bvh["edge1"][pair_faces]
+            edge2 = bvh["edge2"][pair_faces]
+            pvec = np.cross(d, edge2)
+            det = np.einsum('ij,ij->i', edge1, pvec)
+            parallel = np.abs(det) < 1e-12
+            inv_det = 1.0 / np.where(parallel, 1.0, det)
+            tvec = origins[pair_rays] - bvh["v0"][pair_faces]
+            u = np.einsum('ij,ij->i', tvec, pvec) * inv_det
+            qvec = np.cross(tvec, edge1)
+            v = np.einsum('ij,ij->i', d, qvec) * inv_det
+            t = np.einsum('ij,ij->i', edge2, qvec) * inv_det
+            # Petite tolérance : un rayon passant exactement sur une arête commune touche au moins une face
+            valid = (~parallel & (u >= -BARYCENTRIC_TOLERANCE) & (v >= -BARYCENTRIC_TOLERANCE)
+                     & (u + v <= 1 + BARYCENTRIC_TOLERANCE)
+                     & (t > t_min[pair_rays]) & (t < best_t[pair_rays]))
+
+            # Garde l'impact le plus proche de chaque rayon
+            candidates = np.flatnonzero(valid)
+            candidates = candidates[np.lexsort((t[candidates], pair_rays[candidates]))]
+            hit_rays, first = np.unique(pair_rays[candidates], return_index=True)
+            chosen = candidates[first]
+            best_t[hit_rays] = t[chosen]
+            best_face[hit_rays] = bvh["face_ids"][pair_faces[chosen]]
+            best_uv[hit_rays, 0] = u[chosen]
+            best_uv[hit_rays, 1] = v[chosen]
+            break
+
+    best_t[best_face < 0] = np.inf
+    return best_t, best_face, best_uv
+
+SINGLE_RAY_START_LEVEL = 7  # Niveau du BVH testé d'un bloc par intersect_ray_bvh avant le parcours en profondeur
+
+def intersect_ray_bvh(bvh, origin, direction, t_min=0.0, t_max=np.inf):
+    """
+    Intersecte un seul rayon o + t*d avec les faces du BVH, mêmes résultats que intersect_rays_bvh (au dernier
+    bit près : un rayon passant exactement par un sommet commun peut toucher une autre de ses faces).
+    Les boîtes d'un niveau intermédiaire (SINGLE_RAY_START_LEVEL, tranche contiguë de l'arbre implicite)
+    sont testées en un seul calcul NumPy, puis leurs sous-arbres sont parcourus en profondeur sur des
+    flottants Python, la boîte la plus proche d'abord : dès qu'un impact est trouvé, toutes les boîtes
+    plus lointaines sont abandonnées. Pour un rayon seul, cela évite le coût fixe des appels NumPy à
+    chaque niveau du parcours par lots.
+
+    :return: Tuple (t, face, (u, v)) : t vaut inf et face -1 sans impact.
+    """
+    ox, oy, oz = (float(value) for value in origin)
+    dx, dy, dz = (float(value) for value in direction)
+    ix, iy, iz = (1.0 / (value if value != 0 else 1e-300) for value in (dx, dy, dz))
+    t_min, t_max = float(t_min), float(t_max)
+    node_min = bvh["node_min"]
+    node_max = bvh["node_max"]
+    nb_faces = len(bvh["faces"])
+    leaf_size = bvh["leaf_size"]
+    first_leaf = bvh["first_leaf"]
+
+    # Nœuds du niveau de départ touchés par le rayon (méthode des tranches, comme intersect_rays_bvh)
+    level = min(SINGLE_RAY_START_LEVEL, bvh["depth"])
+    first, last = (1 << level) - 1, (1 << (level + 1)) - 1
+    with np.errstate(invalid="ignore", over="ignore"):
+        t1 = (node_min[first:last] - (ox, oy, oz)) * (ix, iy, iz)
+        t2 = (node_max[first:last] - (ox, oy, oz)) * (ix, iy, iz)
+        t_near = np.minimum(t1, t2).max(axis=1)
+        t_far = np.maximum(t1, t2).min(axis=1)
+    hit = np.flatnonzero((node_min[first:last, 0] <= node_max[first:last, 0]) & (t_near <= t_far)
+                         & (t_far >= t_min) & (t_near <= t_max))
+    # Pile triée pour dépiler la boîte la plus proche en premier
+    hit = hit[np.argsort(-t_near[hit], kind="stable")]
+    stack = list(zip(t_near[hit].tolist(), (hit + first).tolist()))
+
+    # Vues plates des tableaux du BVH : l'indexation renvoie directement des flottants Python.
+    # Selon le signe de la direction, la face d'entrée de chaque tranche est le min ou le max de la boîte
+    lo = node_min.reshape(-1).data
+    hi = node_max.reshape(-1).data
+    near_x, far_x = (lo, hi) if ix >= 0 else (hi, lo)
+    near_y, far_y = (lo, hi) if iy >= 0 else (hi, lo)
+    near_z, far_z = (lo, hi) if iz >= 0 else (hi, lo)
+    v0 = bvh["v0"].reshape(-1).data
+    edge1 = bvh["edge1"].reshape(-1).data
+    edge2 = bvh["edge2"].reshape(-1).data
+    best_t, best_position, best_u, best_v = t_max, nb_faces, 0.0, 0.0  # best_position = nb_faces : aucun impact
+    # Boîtes abandonnées au-delà de bound : un peu après le meilleur impact, car l'entrée calculée dans la
+    # boîte d'une face touchée au même t (sommet ou arête commune) peut le dépasser d'un arrondi
+    bound = t_max
+
+    while stack:
+        t_node, node = stack.pop()
+        if t_node > bound:
+            continue
+        if node < first_leaf:
+            entries = []
+            for child in (2 * node + 1, 2 * node + 2):
+                k = 3 * child
+                if lo[k] > hi[k]:
+                    continue  # Nœud vide (boîte inversée, sans face)
+                enter, leave = (near_x[k] - ox) * ix, (far_x[k] - ox) * ix
+                t = (near_y[k + 1] - oy) * iy
+                if t > enter:
+                    enter = t
+                t = (far_y[k + 1] - oy) * iy
+                if t < leave:
+                    leave = t
+                t = (near_z[k + 2] - oz) * iz
+                if t > enter:
+                    enter = t
+                t = (far_z[k + 2] - oz) * iz
+                if t < leave:
+                    leave = t
+                if enter <= leave and leave >= t_min and enter <= bound:
+                    entries.append((enter, child))
+            if len(entries) == 2 and entries[1][0] < entries[0][0]:
+                entries.reverse()
+            # L'enfant le plus proche est empilé en dernier, donc traité en premier
+            stack.extend(reversed(entries))
+            continue
+
+        # Feuille : test de Möller-Trumbore face par face, mêmes opérations que intersect_rays_bvh
+        start = (node - first_leaf) * leaf_size
+        for position in range(start, min(start + leaf_size, nb_faces)):
+            k = 3 * position
+            e1x, e1y, e1z = edge1[k], edge1[k + 1], edge1[k + 2]
+            e2x, e2y, e2z = edge2[k], edge2[k + 1], edge2[k + 2]
+            px, py, pz = dy * e2z - dz * e2y, dz * e2x - dx * e2z, dx * e2y - dy * e2x
+            det = e1x * px + e1y * py + e1z * pz
+            if abs(det) < 1e-12:
+                continue
+            inv_det = 1.0 / det
+            sx, sy, sz = ox - v0[k], oy - v0[k + 1], oz - v0[k + 2]
+            u = (sx * px + sy * py + sz * pz) * inv_det
+            if u < -BARYCENTRIC_TOLERANCE:
+                continue
+            qx, qy, qz = sy * e1z - sz * e1y, sz * e1x - sx * e1z, sx * e1y - sy * e1x
+            v = (dx * qx + dy * qy + dz * qz) * inv_det
+            if v < -BARYCENTRIC_TOLERANCE or u + v > 1 + BARYCENTRIC_TOLERANCE:
+                continue
+            t = (e2x * qx + e2y * qy + e2z * qz) * inv_det
+            # À égalité de t, la face la plus tôt dans le BVH l'emporte, comme dans intersect_rays_bvh
+            if t_min < t < t_max and (t, position) < (best_t, best_position):
+                best_t, best_position, best_u, best_v = t, position, u, v
+                bound = min(t_max, t + BARYCENTRIC_TOLERANCE * (1 + abs(t)))
+
+    if best_position == nb_faces:
+        return np.inf, -1, (0.0, 0.0)
+    return best_t, int(bvh["face_ids"][best_position]), (best_u, best_v)
+
+def set_mesh_transform(mesh, transform):
+    """
+    Associe au mesh une matrice de modèle affine 4x4 (None pour l'identité). Elle est appliquée par le GPU
+    au moment du dessin : mesh.vertices n'est pas modifié et les données déjà envoyées restent valides.
+    """
+    mesh.model_transform = None if transform is None else np.array(transform, dtype=np.float64)
+
+def get_mesh_transform(mesh):
+    """Retourne la matrice de modèle du mesh, ou None s'il n'en a pas."""
+    return getattr(mesh, "model_transform", None)
+
+def transform_points(transform, points):
+    """Applique une matrice affine 4x4 à un tableau (N,3) de points."""
+    return np.asarray(points, dtype=np.float64) @ transform[:3, :3].T + transform[:3, 3]
+
+def get_world_vertices(mesh):
+    """
+    Retourne les sommets du mesh après application de sa matrice de modèle, calculés sur le CPU
+    seulement à la demande et recalculés seulement si les sommets ou la matrice changent.
+    """
+    transform = get_mesh_transform(mesh)
+    if transform is None:
+        return np.asarray(mesh.vertices)
+    key = (hash(mesh.vertices), transform.tobytes())
+    cache = getattr(mesh, "world_vertices_cache", None)
+    if cache is None or cache["key"] != key:
+        cache = mesh.world_vertices_cache = {"key": key, "vertices": transform_points(transform, mesh.vertices)}
+    return cache["vertices"]
+
+def push_mesh_transform(mesh):
+    """Empile la matrice de modèle du mesh sur la pile rlgl ; retourne False (rien à dépiler) s'il n'en a pas."""
+    transform = get_mesh_transform(mesh)
+    if transform is None:
+        return False
+    pr.rl_push_matrix()
+    # rlMultMatrixf attend les 16 valeurs colonne par colonne
+    matrix = np.ascontiguousarray(transform.T, dtype=np.float32)
+    pr.rl_mult_matrixf(pr.ffi.from_buffer("float[]", matrix))
+    return True
+
+def pop_mesh_transform(pushed):
+    """Dépile la matrice empilée par push_mesh_transform."""
+    if pushed:
+        pr.rl_pop_matrix()
+
+def get_mouse_ray(camera, mouse_position=None):
+    """Retourne le rayon (origine, direction) qui part de la caméra et passe par la position de la souris."""
+    if mouse_position is None:
+        mouse_position = pr.get_mouse_position()
+    ray = pr.get_screen_to_world_ray(mouse_position, camera)
+    origin = np.array([ray.position.x, ray.position.y, ray.position.z])
+    direction = np.array([ray.direction.x, ray.direction.y, ray.direction.z])
+    return origin, direction
+
+def get_world_bvh(mesh):
+    """
+    BVH des sommets transformés par la matrice de modèle (quand elle n'est pas inversible, par exemple
+    une projection) : construit une fois par topologie puis réajusté quand la matrice change.
+    """
+    world_vertices = get_world_vertices(mesh)
+    faces_hash = hash(mesh.faces)
+    key = mesh.world_vertices_cache["key"]
+    cache = getattr(mesh, "world_bvh_cache", None)
+    if cache is None or cache["faces_hash"] != faces_hash:
+        cache = mesh.world_bvh_cache = {"bvh": build_bvh(world_vertices, mesh.faces), "faces_hash": faces_hash}
+    elif cache["key"] != key:
+        refit_bvh(cache["bvh"], world_vertices)
+    cache["key"] = key
+    return cache["bvh"]
+
+def pick_mesh(mesh, origin, direction):
+    """
+    Sélectionne la face du mesh (sommets courants, éventuellement transformés) touchée en premier par un rayon.
+    Si le mesh a une matrice de modèle inversible, c'est le rayon qui est ramené dans l'espace du mesh :
+    le BVH des sommets d'origine reste valide.
+
+    :return: None si le rayon ne touche rien, sinon un dictionnaire avec la face touchée, le point d'impact,
+             ses coordonnées barycentriques, le sommet de la face le plus proche et la distance à l'origine.
+    """
+    origin = np.asarray(origin, dtype=np.float64)
+    direction = np.asarray(direction, dtype=np.float64)
+    transform = get_mesh_transform(mesh)
+    if transform is None:
+        t, face_index, (u, v) = intersect_ray_bvh(get_mesh_bvh(mesh), origin, direction)
+    elif abs(np.linalg.det(transform[:3, :3])) > 1e-12:
+        # Transformation affine : le paramètre t est le même dans les deux espaces
+        inverse = np.linalg.inv(transform)
+        t, face_index, (u, v) = intersect_ray_bvh(get_mesh_bvh(mesh), transform_points(inverse, origin[np.newaxis])[0],
+                                                  inverse[:3, :3] @ direction)
+    else:
+        t, face_index, (u, v) = intersect_ray_bvh(get_world_bvh(mesh), origin, direction)
+    if face_index < 0:
+        return None
+
+    # Indexer mesh.faces (TrackedArray) marquerait son hash comme périmé et forcerait le recalcul de tous
+    # les caches indexés sur hash(mesh.faces) à chaque image : on passe par la vue ndarray
+    face = np.asarray(mesh.faces)[face_index]
+    point = origin + t * direction
+    corners = np.asarray(mesh.vertices)[face]
+    if transform is not None:
+        corners = transform_points(transform, corners)
+    nearest_corner = np.argmin(np.linalg.norm(corners - point, axis=1))
+    return {
+        "face": face_index,
+        "point": point,
+        "barycentric": np.array([1 - u - v, u, v]),
+        "vertex": int(face[nearest_corner]),
+        "distance": float(t * np.linalg.norm(direction)),
+    }
+
+def pick_mesh_with_mouse(mesh, camera):
+    """Sélectionne la face du mesh sous la souris."""
+    origin, direction = get_mouse_ray(camera)
+    return pick_mesh(mesh, origin, direction)
+
+def draw_selection(mesh, selection, color=pr.ORANGE):
+    """Met en évidence la face et le sommet sélectionnés par pick_mesh."""
+    if selection is None:
+        return
+    corners = np.asarray(mesh.vertices)[np.asarray(mesh.faces)[selection["face"]]]
+    transform = get_mesh_transform(mesh)
+    if transform is not None:
+        corners = transform_points(transform, corners)
+    # Léger décalage le long de la normale pour que la face surlignée reste visible au-dessus du mesh
+    normal = np.cross(corners[1] - corners[0], corners[2] - corners[0])
+    length = np.linalg.norm(normal)
+    if length != 0:
+        corners = corners + normal / length * 0.01
+    v0, v1, v2 = (Vector3(*corner) for corner in corners.tolist())
+    pr.draw_triangle_3d(v0, v1, v2, color)
+    pr.draw_triangle_3d(v0, v2, v1, color)
+    vertex = np.asarray(mesh.vertices)[selection["vertex"]]
+    if transform is not None:
+        vertex = transform_points(transform, vertex[np.newaxis])[0]
+    pr.draw_sphere(Vector3(*vertex.tolist()), 0.08, pr.MAGENTA)
+
+MAX_INDEXED_VERTICES = 65535  # Les indices d'un Mesh raylib sont des unsigned short
+
+def gpu_vertex_data(vertices, triangles, indexed):
+    """Retourne les sommets au format attendu par le tampon GPU (float32 contigu)."""
+    if indexed:
+        return np.ascontiguousarray(vertices, dtype=np.float32)
+    # Sans indices, chaque triangle possède ses trois sommets
+    return np.ascontiguousarray(np.asarray(vertices)[triangles].reshape(-1, 3), dtype=np.float32)
+
+def build_gpu_model(vertices, triangles):
+    """
+    Construit un Model raylib à partir de sommets (V,3) et de triangles (T,3) et l'envoie sur le GPU.
+    Retourne un dictionnaire contenant le modèle et les informations nécessaires à sa mise à jour.
+    """
+    triangles = np.asarray(triangles)
+    indexed = len(vertices) <= MAX_INDEXED_VERTICES
+    vertex_data = gpu_vertex_data(vertices, triangles, indexed)
+
+    rl_mesh = pr.Mesh()
+    rl_mesh.vertexCount = len(vertex_data)
+    rl_mesh.triangleCount = len(triangles)
+    # Mémoire allouée par raylib : elle sera libérée par unload_model
+    rl_mesh.vertices = pr.ffi.cast("float *", pr.mem_alloc(vertex_data.nbytes))
+    pr.ffi.memmove(rl_mesh.vertices, vertex_data, vertex_data.nbytes)
+    if indexed:
+        index_data = np.ascontiguousarray(triangles, dtype=np.uint16)
+        rl_mesh.indices = pr.ffi.cast("unsigned short *", pr.mem_alloc(index_data.nbytes))
+        pr.ffi.memmove(rl_mesh.indices, index_data, index_data.nbytes)
+
+    pr.upload_mesh(rl_mesh, True)  # Tampon dynamique pour les mises à jour en place
+    return {
+        "model": pr.load_model_from_mesh(rl_mesh),
+        "indexed": indexed,
+        "triangles": triangles,
+    }
+
+def update_gpu_model(gpu_model, vertices):
+    """Met à jour en place le tampon de sommets d'un modèle construit par build_gpu_model."""
+    rl_mesh = gpu_model["model"].meshes[0]
+    vertex_data = gpu_vertex_data(vertices, gpu_model["triangles"], gpu_model["indexed"])
+    pr.ffi.memmove(rl_mesh.vertices, vertex_data, vertex_data.nbytes)
+    pr.update_mesh_buffer(rl_mesh, 0, rl_mesh.vertices, vertex_data.nbytes, 0)
+
+def sync_mesh_gpu_model(mesh, name, triangles_func):
+    """
+    Retourne le modèle GPU mesh.gpu_models[name], construit une seule fois par topologie.
+    Le tampon de sommets n'est mis à jour que si mesh.vertices a changé.
+
+    :param mesh: Mesh trimesh source.
+    :param name: Nom du modèle ("faces", "wireframe", ...).
+    :param triangles_func: Fonction mesh -> triangles (T,3) appelée à la construction.
+    """
+    gpu_models = getattr(mesh, "gpu_models", None)
+    if gpu_models is None:
+        gpu_models = mesh.gpu_models = {}
+    faces_hash = hash(mesh.faces)
+    vertices_hash = hash(mesh.vertices)
+
+    gpu_model = gpu_models.get(name)
+    if gpu_model is not None and gpu_model["faces_hash"] != faces_hash:
+        # La topologie a changé : le modèle doit être reconstruit
+        pr.unload_model(gpu_model["model"])
+        gpu_model = None
+    if gpu_model is None:
+        gpu_model = gpu_models[name] = build_gpu_model(mesh.vertices, triangles_func(mesh))
+    elif gpu_model["vertices_hash"] != vertices_hash:
+        update_gpu_model(gpu_model, mesh.vertices)
+    gpu_model["faces_hash"] = faces_hash
+    gpu_model["vertices_hash"] = vertices_hash
+    return gpu_model
+
+def unload_mesh_model(mesh):
+    """Libère les Model raylib associés au mesh (à appeler avant pr.close_window)."""
+    for gpu_model in getattr(mesh, "gpu_models", {}).values():
+        pr.unload_model(gpu_model["model"])
+    mesh.gpu_models = {}
+
+def draw_mesh_model(mesh, color=pr.LIGHTGRAY):
+    """Dessine toutes les faces du mesh en un seul appel à partir du Model présent sur le GPU (avec sa matrice de modèle)."""
+    gpu_model = sync_mesh_gpu_model(mesh, "faces", lambda m: m.faces)
+    pushed = push_mesh_transform(mesh)
+    pr.draw_model(gpu_model["model"], Vector3(0, 0, 0), 1.0, color)
+    pop_mesh_transform(pushed)
+
+def compute_unique_edges(faces):
+    """Calcule les arêtes uniques (E,2) de faces triangulaires : chaque arête n'apparaît qu'une fois."""
+    faces = np.asarray(faces, dtype=np.int64)
+    if len(faces) == 0:
+        return np.empty((0, 2), dtype=np.int64)
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+
+    # Chaque arête (a, b) avec a < b est codée par un entier pour un np.unique 1D rapide
+    nb_vertices = int(faces.max()) + 1
+    keys = np.unique(edges[:, 0] * nb_vertices + edges[:, 1])
+    return np.column_stack((keys // nb_vertices, keys % nb_vertices))
+
+def get_unique_edges(mesh):
+    """Retourne les arêtes uniques du mesh, recalculées seulement quand mesh.faces change."""
+    faces_hash = hash(mesh.faces)
+    cache = getattr(mesh, "unique_edges_cache", None)
+    if cache is None or cache["faces_hash"] != faces_hash:
+        cache = mesh.unique_edges_cache = {"faces_hash": faces_hash, "edges": compute_unique_edges(mesh.faces)}
+    return cache["edges"]
+
+def edge_triangles(mesh):
+    """Triangles dégénérés (a, b, b) : en mode fil de fer chacun trace exactement une arête unique."""
+    return get_unique_edges(mesh)[:, [0, 1, 1]]
+
+INSTANCING_VERTEX_SHADER = """
+#version 330
+in vec3 vertexPosition;
+in mat4 instanceTransform;
+uniform mat4 mvp;
+uniform vec4 colDiffuse;
+out vec4 fragColor;
+void main()
+{
+    // La dernière ligne de la transformation (inutilisée en affine) porte la couleur de l'instance
+    mat4 transform = instanceTransform;
+    fragColor = vec4(transform[0][3], transform[1][3], transform[2][3], 1.0)*colDiffuse;
+    transform[0][3] = 0.0;
+    transform[1][3] = 0.0;
+    transform[2][3] = 0.0;
+    gl_Position = mvp*transform*vec4(vertexPosition, 1.0);
+}
+"""
+
+INSTANCING_FRAGMENT_SHADER = """
+#version 330
+in vec4 fragColor;
+out vec4 finalColor;
+void main()
+{
+    finalColor = fragColor;
+}
+"""
+
+instancing_resources = {}
+
+def get_instancing_material():
+    """Charge une seule fois le shader d'instanciation et retourne le matériau qui l'utilise."""
+    if "material" not in instancing_resources:
+        shader = pr.load_shader_from_memory(INSTANCING_VERTEX_SHADER, INSTANCING_FRAGMENT_SHADER)
+        shader.locs[pr.SHADER_LOC_MATRIX_MVP] = pr.get_shader_location(shader, "mvp")
+        shader.locs[pr.SHADER_LOC_COLOR_DIFFUSE] = pr.get_shader_location(shader, "colDiffuse")
+        shader.locs[pr.SHADER_LOC_VERTEX_INSTANCETRANSFORM] = pr.get_shader_location_attrib(shader, "instanceTransform")
+        material = pr.load_material_default()
+        material.shader = shader
+        instancing_resources["material"] = material
+    return instancing_resources["material"]
+
+def get_instancing_mesh(name, generator):
+    """Génère (une seule fois) et retourne le Mesh raylib partagé par toutes les instances de ce nom."""
+    if name not in instancing_resources:
+        instancing_resources[name] = generator()
+    return instancing_resources[name]
+
+def unload_instancing_resources():
+    """Libère le shader et les Mesh d'instanciation (à appeler avant pr.close_window)."""
+    material = instancing_resources.pop("material", None)
+    if material is not None:
+        pr.unload_material(material)
+    for rl_mesh in instancing_resources.values():
+        pr.unload_mesh(rl_mesh)
+    instancing_resources.clear()
+
+def draw_instances(rl_mesh, transforms, color=pr.WHITE):
+    """
+    Dessine en un seul appel toutes les instances d'un Mesh raylib.
+
+    :param rl_mesh: Mesh raylib partagé.
+    :param transforms: Tableau (N,4,4) des transformations (ligne 3 = couleur RGB de l'instance entre 0 et 1).
+    :param color: Couleur multipliée par celle de chaque instance.
+    """
+    if len(transforms) == 0:
+        return
+    material = get_instancing_material()
+    material.maps[pr.MATERIAL_MAP_DIFFUSE].color = color
+    matrices = np.ascontiguousarray(transforms, dtype=np.float32)
+    pr.draw_mesh_instanced(rl_mesh, material, pr.ffi.from_buffer("Matrix[]", matrices), len(matrices))
+
+def edge_instance_transforms(vertices, edges, radius):
+    """
+    Calcule les transformations (E,4,4) qui amènent un cylindre unitaire (axe Y de 0 à 1, rayon 1)
+    sur chaque arête, avec le rayon donné.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    starts = vertices[edges[:, 0]]
+    directions = vertices[edges[:, 1]] - starts
+    lengths = np.linalg.norm(directions, axis=1)
+    unit_directions = np.zeros_like(directions)
+    valid = lengths != 0
+    unit_directions[valid] = directions[valid] / lengths[valid, np.newaxis]
+    unit_directions[~valid] = (0.0, 1.0, 0.0)
+
+    # Base orthonormée (u, direction, w) autour de chaque arête
+    helpers = np.zeros_like(directions)
+    use_x = np.abs(unit_directions[:, 0]) < 0.9
+    helpers[use_x, 0] = 1.0
+    helpers[~use_x, 1] = 1.0
+    u = np.cross(unit_directions, helpers)
+    u /= np.linalg.norm(u, axis=1)[:, np.newaxis]
+    w = np.cross(u, unit_directions)
+
+    transforms = np.zeros((len(edges), 4, 4))
+    transforms[:, :3, 0] = u * radius
+    transforms[:, :3, 1] = directions
+    transforms[:, :3, 2] = w * radius
+    transforms[:, :3, 3] = starts
+    transforms[:, 3, :] = 1.0  # Couleur blanche : la couleur du matériau s'applique telle quelle
+    return transforms
+
+def draw_mesh_wireframe(mesh, color=pr.BLACK, thickness=None):
+    """
+    Dessine toutes les arêtes uniques du mesh en un seul appel.
+
+    :param mesh: Mesh trimesh à dessiner.
+    :param color: Couleur des arêtes.
+    :param thickness: None pour un lot de lignes fines ; sinon diamètre des cylindres instanciés, dans le
+                      repère du mesh (les cylindres suivent sa matrice de modèle, comme les faces).
+    """
+    if thickness is None:
+        gpu_model = sync_mesh_gpu_model(mesh, "wireframe", edge_triangles)
+        # Les triangles dégénérés sont d'aire nulle : le culling les éliminerait
+        pr.rl_disable_backface_culling()
+        pushed = push_mesh_transform(mesh)
+        pr.draw_model_wires(gpu_model["model"], Vector3(0, 0, 0), 1.0, color)
+        pop_mesh_transform(pushed)
+        pr.rl_enable_backface_culling()
+        return
+
+    # Cylindres placés dans le repère du mesh et dessinés sous sa matrice de modèle (le rendu instancié
+    # l'applique avec la pile rlgl) : changer la matrice ne recalcule rien côté CPU
+    key = (hash(mesh.vertices), hash(mesh.faces), thickness)
+    cache = getattr(mesh, "edge_instances_cache", None)
+    if cache is None or cache["key"] != key:
+        transforms = edge_instance_transforms(np.asarray(mesh.vertices), get_unique_edges(mesh), thickness / 2)
+        cache = mesh.edge_instances_cache = {"key": key, "transforms": transforms.astype(np.float32)}
+    cylinder = get_instancing_mesh("cylinder", lambda: pr.gen_mesh_cylinder(1.0, 1.0, 8))
+    pushed = push_mesh_transform(mesh)
+    draw_instances(cylinder, cache["transforms"], color)
+    pop_mesh_transform(pushed)
+
+# Niveaux de détail des sphères : (rapport rayon / distance minimal, anneaux, tranches)
+SPHERE_LOD_LEVELS = ((0.02, 12, 12), (0.005, 8, 8), (0.0, 4, 4))
+
+POINT_SPRITE_THRESHOLD = 1_000_000  # Au-delà, les sommets sont dessinés comme des points
+
+def points_to_array(points):
+    """Convertit une liste de Vector3 (ou un tableau) en tableau (N,3) de float64."""
+    if isinstance(points, np.ndarray):
+        return points.astype(np.float64, copy=False).reshape(-1, 3)
+    return np.array([(point.x, point.y, point.z) for point in points], dtype=np.float64).reshape(-1, 3)
+
+def sphere_lod(camera, points, radius):
+    """
+    Choisit la tessellation (anneaux, tranches) des sphères à partir de la distance entre la caméra
+    et la boîte englobante des points : plus les sphères paraissent petites, moins elles ont de faces.
+    """
+    if camera is None or len(points) == 0:
+        _, rings, slices = SPHERE_LOD_LEVELS[0]
+        return rings, slices
+    position = np.array([camera.position.x, camera.position.y, camera.position.z])
+    # Réduction sur une copie transposée contiguë : bien plus rapide que min(axis=0) sur un tableau (N,3)
+    columns = np.ascontiguousarray(points.T)
+    nearest = np.clip(position, columns.min(axis=1), columns.max(axis=1))
+    distance = np.linalg.norm(position - nearest)
+    ratio = radius / distance if distance > 0 else math.inf
+    for min_ratio, rings, slices in SPHERE_LOD_LEVELS:
+        if ratio >= min_ratio:
+            return rings, slices
+    _, rings, slices = SPHERE_LOD_LEVELS[-1]
+    return rings, slices
+
+def marker_instance_transforms(points, radius, colors=None):
+    """
+    Calcule les transformations (N,4,4) d'une sphère unitaire vers chaque point.
+
+    :param colors: None (blanc) ou tableau (N,3)/(N,4) de couleurs 0-255, une par point.
+    """
+    transforms = np.zeros((len(points), 4, 4), dtype=np.float32)
+    transforms[:, 0, 0] = radius
+    transforms[:, 1, 1] = radius
+    transforms[:, 2, 2] = radius
+    transforms[:, :3, 3] = points
+    transforms[:, 3, 3] = 1.0
+    if colors is None:
+        transforms[:, 3, :3] = 1.0
+    else:
+        transforms[:, 3, :3] = np.asarray(colors)[:, :3] / 255.0
+    return transforms
+
+def draw_markers(points, radius, colors, camera=None):
+    """
+    Dessine en un seul appel une petite sphère par point (rendu instancié).
+
+    :param points: Tableau (N,3) ou liste de Vector3.
+    :param radius: Rayon des sphères.
+    :param colors: Color unique ou tableau (N,3)/(N,4) de couleurs 0-255 (une par point).
+    :param camera: Caméra utilisée pour choisir la tessellation (la plus fine si None).
+    """
+    points = points_to_array(points)
+    if np.asarray(colors).ndim == 1:
+        transforms = marker_instance_transforms(points, radius)
+        color = colors
+    else:
+        transforms = marker_instance_transforms(points, radius, colors)
+        color = pr.WHITE
+    rings, slices = sphere_lod(camera, points, radius)
+    sphere = get_instancing_mesh(f"sphere_{rings}x{slices}", lambda: pr.gen_mesh_sphere(1.0, rings, slices))
+    draw_instances(sphere, transforms, color)
+
+def world_bounds_corners(mesh):
+    """Les 8 coins de la boîte englobante du mesh, transformés par sa matrice de modèle."""
+    if len(mesh.vertices) == 0:
+        return np.empty((0, 3))
+    bounds = np.asarray(mesh.bounds)
+    corners = np.array([[bounds[i, 0], bounds[j, 1], bounds[k, 2]] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+    transform = get_mesh_transform(mesh)
+    return corners if transform is None else transform_points(transform, corners)
+
+def point_triangles(mesh):
+    """Regroupe les sommets par triplets consécutifs : en mode points chaque sommet est dessiné une fois."""
+    nb_vertices = len(mesh.vertices)
+    indices = np.arange(nb_vertices + (-nb_vertices) % 3)
+    return np.minimum(indices, nb_vertices - 1).reshape(-1, 3)
+
+def draw_mesh_markers(mesh, radius=0.05, color=pr.RED, camera=None, point_sprites=None):
+    """
+    Dessine les sommets du mesh en un seul appel.
+
+    :param radius: Rayon des sphères dans le repère du mesh (elles suivent sa matrice de modèle, comme les faces).
+    :param point_sprites: True pour des points, False pour des sphères instanciées,
+                          None pour choisir selon POINT_SPRITE_THRESHOLD.
+    """
+    if point_sprites is None:
+        point_sprites = len(mesh.vertices) > POINT_SPRITE_THRESHOLD
+    if point_sprites:
+        gpu_model = sync_mesh_gpu_model(mesh, "points", point_triangles)
+        pr.rl_disable_backface_culling()
+        pr.rl_enable_point_mode()
+        pushed = push_mesh_transform(mesh)
+        pr.draw_model(gpu_model["model"], Vector3(0, 0, 0), 1.0, color)
+        pop_mesh_transform(pushed)
+        pr.rl_disable_point_mode()
+        pr.rl_enable_backface_culling()
+        return
+
+    # Sphères placées sur les sommets dans le repère du mesh et dessinées sous sa matrice de modèle (le rendu
+    # instancié l'applique avec la pile rlgl) : changer la matrice ne recalcule rien côté CPU
+    key = (hash(mesh.vertices), radius)
+    cache = getattr(mesh, "marker_instances_cache", None)
+    if cache is None or cache["key"] != key:
+        transforms = marker_instance_transforms(np.asarray(mesh.vertices), radius)
+        cache = mesh.marker_instances_cache = {"key": key, "transforms": transforms}
+    # Tessellation choisie d'après la boîte englobante transformée (8 coins) et le rayon mis à l'échelle
+    transform = get_mesh_transform(mesh)
+    world_radius = radius if transform is None else radius * np.linalg.norm(transform[:3, :3], axis=0).max()
+    rings, slices = sphere_lod(camera, world_bounds_corners(mesh), world_radius)
+    sphere = get_instancing_mesh(f"sphere_{rings}x{slices}", lambda: pr.gen_mesh_sphere(1.0, rings, slices))
+    pushed = push_mesh_transform(mesh)
+    draw_instances(sphere, cache["transforms"], color)
+    pop_mesh_transform(pushed)
+
+def sphere_geometry(rings, slices):
+    """Sphère unitaire (anneaux, tranches) : sommets (V,3) et triangles (T,3) orientés vers l'extérieur."""
+    theta = np.linspace(0, np.pi, rings + 1)[:, np.newaxis]
+    phi = np.linspace(0, 2 * np.pi, slices, endpoint=False)[np.newaxis, :]
+    vertices = np.stack((np.sin(theta) * np.cos(phi), np.cos(theta) * np.ones_like(phi),
+                         np.sin(theta) * np.sin(phi)), axis=-1).reshape(-1, 3)
+    ring, column = np.meshgrid(np.arange(rings), np.arange(slices), indexing="ij")
+    a = ring * slices + column
+    b = ring * slices + (column + 1) % slices
+    c = a + slices
+    d = b + slices
+    triangles = np.concatenate((np.stack((a, b, c), axis=-1), np.stack((b, d, c), axis=-1)), axis=1)
+    return vertices, triangles.reshape(-1, 3)
+
+def sync_marker_model(mesh, radius, rings, slices):
+    """
+    Retourne le modèle GPU contenant une sphère de rayon radius autour de chaque sommet du mesh, dans
+    le repère du mesh : instancié avec les mêmes matrices que les faces, il dessine les sommets de toutes
+    les instances sans aucun calcul par sommet côté CPU. Reconstruit seulement si le mesh ou les
+    paramètres des sphères changent (stocké dans mesh.gpu_models, libéré par unload_mesh_model).
+    """
+    gpu_models = getattr(mesh, "gpu_models", None)
+    if gpu_models is None:
+        gpu_models = mesh.gpu_models = {}
+    key = (hash(mesh.vertices), radius, rings, slices)
+    gpu_model = gpu_models.get("markers")
+    if gpu_model is not None and gpu_model["key"] != key:
+        pr.unload_model(gpu_model["model"])
+        gpu_model = None
+    if gpu_model is None:
+        sphere_vertices, sphere_triangles = sphere_geometry(rings, slices)
+        vertices = np.asarray(mesh.vertices, dtype=np.float64)
+        positions = (vertices[:, np.newaxis, :] + radius * sphere_vertices).reshape(-1, 3)
+        offsets = np.arange(len(vertices))[:, np.newaxis, np.newaxis] * len(sphere_vertices)
+        triangles = (sphere_triangles + offsets).reshape(-1, 3)
+        gpu_model = gpu_models["markers"] = build_gpu_model(positions, triangles)
+        gpu_model["key"] = key
+    return gpu_model
+
+def draw_mesh_instances(mesh, transforms, color=pr.LIGHTGRAY, camera=None, wire_color=pr.BLACK,
+                        marker_color=pr.RED, marker_radius=0.05):
+    """
+    Dessine K copies du mesh (faces, arêtes et sommets) en trois appels instanciés au total,
+    à partir du Model déjà présent sur le GPU : le coût dépend du nombre d'instances, pas du nombre d'appels.
+
+    :param mesh: Mesh partagé par toutes les instances (jamais modifié).
+    :param transforms: Tableau (K,4,4) des matrices monde affines des instances.
+    :param color: Couleur des faces.
+    :param camera: Caméra utilisée pour choisir la tessellation des sphères des sommets.
+    :param marker_radius: Rayon des sphères des sommets dans le repère du mesh (None pour ne pas les dessiner) :
+                          les sphères font partie du modèle instancié et suivent l'échelle de chaque instance.
+    """
+    transforms = np.asarray(transforms)
+    count = len(transforms)
+    if count == 0:
+        return
+    # Tampon float32 des instances conservé sur le mesh, réalloué seulement quand K dépasse sa capacité
+    buffer = getattr(mesh, "instance_buffer", None)
+    if buffer is None or len(buffer) < count:
+        buffer = mesh.instance_buffer = np.zeros((count, 4, 4), dtype=np.float32)
+        buffer[:, 3, :] = 1.0  # Couleur blanche : la couleur du matériau s'applique telle quelle
+    instance_transforms = buffer[:count]
+    instance_transforms[:, :3, :] = transforms[:, :3, :]  # La ligne 3 (couleur) reste en place
+
+    faces_model = sync_mesh_gpu_model(mesh, "faces", lambda m: m.faces)
+    draw_instances(faces_model["model"].meshes[0], instance_transforms, color)
+
+    wire_model = sync_mesh_gpu_model(mesh, "wireframe", edge_triangles)
+    pr.rl_disable_backface_culling()
+    pr.rl_enable_wire_mode()
+    draw_instances(wire_model["model"].meshes[0], instance_transforms, wire_color)
+    pr.rl_disable_wire_mode()
+    pr.rl_enable_backface_culling()
+
+    if marker_radius is not None:
+        # Sphères des sommets déjà intégrées au modèle instancié : rien à calculer par sommet et par instance
+        # Tessellation choisie d'après la position des instances (origines de leurs repères)
+        rings, slices = sphere_lod(camera, transforms[:, :3, 3], marker_radius)
+        marker_model = sync_marker_model(mesh, marker_radius, rings, slices)
+        draw_instances(marker_model["model"].meshes[0], instance_transforms, marker_color)
+
+CAMERA_KEYS = (pr.KEY_W, pr.KEY_S, pr.KEY_A, pr.KEY_D, pr.KEY_Q, pr.KEY_E)  # Touches lues par update_camera_position
+
+IDLE_WAIT_TIMEOUT = 0.5  # Secondes maximum d'attente entre deux images en mode repos
+
+def has_input_activity():
+    """Indique si l'utilisateur interagit : touche de caméra, bouton, déplacement ou molette de la souris, redimensionnement."""
+    if any(pr.is_key_down(key) for key in CAMERA_KEYS):
+        return True
+    if any(pr.is_mouse_button_down(button) for button in (pr.MOUSE_BUTTON_LEFT, pr.MOUSE_BUTTON_RIGHT, pr.MOUSE_BUTTON_MIDDLE)):
+        return True
+    delta = pr.get_mouse_delta()
+    return delta.x != 0 or delta.y != 0 or pr.get_mouse_wheel_move() != 0 or pr.is_window_resized()
+
+def create_idle_mode(enabled=False, timeout=IDLE_WAIT_TIMEOUT, grace_frames=3):
+    """
+    Crée l'état du mode repos (désactivé par défaut).
+
+    :param enabled: Active le mode repos.
+    :param timeout: Durée maximale d'attente d'un événement, en secondes (redessin à basse fréquence).
+    :param grace_frames: Nombre d'images sans activité avant de passer au repos.
+    :return: Dictionnaire d'état à passer à wait_if_idle.
+    """
+    return {"enabled": enabled, "timeout": timeout, "grace_frames": grace_frames, "quiet_frames": 0, "idle_frames": 0}
+
+def wait_if_idle(idle_mode, active=False):
+    """
+    À appeler après pr.end_drawing(). Si rien n'a bougé (ni entrée, ni contrôle, ni animation signalée
+    par active) depuis grace_frames images, bloque jusqu'au prochain événement d'entrée ou au plus
+    timeout secondes au lieu de redessiner à la fréquence cible. Toute interaction réveille la boucle
+    immédiatement et la fréquence normale reprend.
+
+    :param idle_mode: État créé par create_idle_mode.
+    :param active: Vrai si la scène a changé pendant cette image (contrôle modifié, animation).
+    :return: True si la boucle a attendu.
+    """
+    if not idle_mode["enabled"]:
+        return False
+    if active or has_input_activity():
+        idle_mode["quiet_frames"] = 0
+        return False
+    idle_mode["quiet_frames"] += 1
+    if idle_mode["quiet_frames"] <= idle_mode["grace_frames"]:
+        return False
+    pr.glfw_wait_events_timeout(idle_mode["timeout"])
+    idle_mode["idle_frames"] += 1
+    return True
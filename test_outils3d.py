@@ -0,0 +1,130 @@
+"""Vérifications de outils3d qui ne demandent pas de fenêtre raylib (lancer avec python -m pytest)."""
+import itertools
+
+import numpy as np
+import pytest
+import trimesh
+
+import outils3d
+
+
+def test_pick_and_selection_keep_faces_hash_cached(monkeypatch):
+    """pick_mesh et draw_selection ne doivent pas invalider le hash de mesh.faces (caches BVH, GPU, arêtes)."""
+    for name in ("draw_triangle_3d", "draw_sphere"):
+        monkeypatch.setattr(outils3d.pr, name, lambda *args: None)
+    mesh = trimesh.creation.box()
+    outils3d.get_mesh_bvh(mesh)
+    hash(mesh.faces)
+    assert not mesh.faces._dirty_hash
+
+    selection = outils3d.pick_mesh(mesh, (0.0, 0.0, 5.0), (0.0, 0.0, -1.0))
+    assert selection is not None
+    outils3d.draw_selection(mesh, selection)
+    assert not mesh.faces._dirty_hash
+
+    outils3d.set_mesh_transform(mesh, np.diag([2.0, 2.0, 2.0, 1.0]))
+    selection = outils3d.pick_mesh(mesh, (0.0, 0.0, 5.0), (0.0, 0.0, -1.0))
+    outils3d.draw_selection(mesh, selection)
+    assert not mesh.faces._dirty_hash
+
+
+def write_polygon_ply(path, vertices, polygons, file_format):
+    """Écrit un PLY de test dont les faces sont des polygones de tailles quelconques."""
+    header = (f"ply\nformat {file_format} 1.0\nelement vertex {len(vertices)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              f"element face {len(polygons)}\nproperty list uchar int vertex_indices\nend_header\n")
+    with open(path, "wb") as file:
+        file.write(header.encode("ascii"))
+        if file_format == "ascii":
+            for vertex in vertices:
+                file.write(("%r %r %r\n" % tuple(float(value) for value in vertex)).encode("ascii"))
+            for polygon in polygons:
+                file.write((" ".join(str(value) for value in [len(polygon)] + list(polygon)) + "\n").encode("ascii"))
+            return
+        order = "<" if file_format == "binary_little_endian" else ">"
+        file.write(np.asarray(vertices, dtype=order + "f4").tobytes())
+        for polygon in polygons:
+            file.write(np.uint8(len(polygon)).tobytes())
+            file.write(np.asarray(polygon, dtype=order + "i4").tobytes())
+
+
+@pytest.mark.parametrize("file_format", ["ascii", "binary_little_endian", "binary_big_endian"])
+@pytest.mark.parametrize("polygons, triangles", [
+    ([[0, 1, 2, 3], [0, 2, 4]], [[0, 1, 2], [0, 2, 3], [0, 2, 4]]),  # Quadrilatère en premier
+    ([[0, 2, 4], [0, 1, 2, 3]], [[0, 2, 4], [0, 1, 2], [0, 2, 3]]),  # Triangle en premier
+    ([[0, 1, 2], [1, 2, 4]], [[0, 1, 2], [1, 2, 4]]),                # Triangles seulement (projection mémoire)
+    ([[0, 1, 2, 3], [1, 2, 4, 0]], [[0, 1, 2], [0, 2, 3], [1, 2, 4], [1, 4, 0]]),  # Quadrilatères seulement
+])
+def test_read_ply_mixed_polygons(tmp_path, file_format, polygons, triangles):
+    """read_ply découpe les polygones en éventail quel que soit l'ordre des tailles et le format."""
+    vertices = np.arange(15, dtype=np.float64).reshape(5, 3) / 4
+    path = str(tmp_path / "mesh.ply")
+    write_polygon_ply(path, vertices, polygons, file_format)
+    data = outils3d.read_ply(path)
+    assert data["faces"].tolist() == triangles
+    for axis, name in enumerate(("x", "y", "z")):
+        np.testing.assert_array_equal(np.asarray(data["vertex"][name], dtype=np.float64), vertices[:, axis])
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_export_mesh_streams_world_vertices_and_normals(tmp_path, monkeypatch, binary):
+    """export_mesh applique la matrice de modèle par blocs, sans passer par get_world_vertices."""
+    monkeypatch.setattr(outils3d, "get_world_vertices", lambda mesh: pytest.fail("sommets du monde matérialisés"))
+    mesh = trimesh.creation.icosphere(subdivisions=2)
+    transform = np.diag([2.0, 0.5, 1.0, 1.0])
+    transform[:3, 3] = (1.0, -2.0, 3.0)
+    outils3d.set_mesh_transform(mesh, transform)
+    path = str(tmp_path / "export.ply")
+    outils3d.export_mesh(mesh, path, binary=binary, with_normals=True, chunk_size=50)
+
+    world = outils3d.transform_points(transform, mesh.vertices)
+    data = outils3d.read_ply(path)
+    exported = np.column_stack([data["vertex"][name] for name in ("x", "y", "z")])
+    normals = np.column_stack([data["vertex"][name] for name in ("nx", "ny", "nz")])
+    np.testing.assert_allclose(exported, world, atol=1e-6)
+    np.testing.assert_allclose(normals, outils3d.compute_vertex_normals_array(world, mesh.faces), atol=1e-6)
+    assert data["faces"].tolist() == np.asarray(mesh.faces).tolist()
+
+
+def test_markers_and_thick_edges_follow_model_matrix_on_gpu(monkeypatch):
+    """Sphères et cylindres sont calculés dans le repère du mesh puis dessinés sous sa matrice de modèle."""
+    monkeypatch.setattr(outils3d, "get_world_vertices", lambda mesh: pytest.fail("sommets du monde matérialisés"))
+    calls = []
+    monkeypatch.setattr(outils3d, "get_instancing_mesh", lambda name, generator: name)
+    monkeypatch.setattr(outils3d, "draw_instances", lambda rl_mesh, transforms, color: calls.append(("draw", transforms)))
+    monkeypatch.setattr(outils3d, "push_mesh_transform", lambda mesh: calls.append("push") or True)
+    monkeypatch.setattr(outils3d, "pop_mesh_transform", lambda pushed: calls.append("pop"))
+    mesh = trimesh.creation.box()
+    outils3d.draw_mesh_markers(mesh, radius=0.1, point_sprites=False)
+    outils3d.draw_mesh_wireframe(mesh, thickness=0.02)
+    markers, edges = calls[1][1], calls[4][1]
+    assert [call if isinstance(call, str) else call[0] for call in calls] == ["push", "draw", "pop"] * 2
+    np.testing.assert_allclose(markers[:, :3, 3], mesh.vertices)
+
+    # Changer la matrice de modèle ne recalcule pas les instances
+    outils3d.set_mesh_transform(mesh, np.diag([2.0, 0.5, 1.0, 1.0]))
+    calls.clear()
+    outils3d.draw_mesh_markers(mesh, radius=0.1, point_sprites=False)
+    outils3d.draw_mesh_wireframe(mesh, thickness=0.02)
+    assert calls[1][1] is markers and calls[4][1] is edges
+
+
+def test_single_ray_matches_batch_traversal():
+    """intersect_ray_bvh (un rayon, plus proche d'abord) touche les mêmes faces que intersect_rays_bvh."""
+    rng = np.random.default_rng(0)
+    for mesh, leaf_size in itertools.product((trimesh.creation.box(), trimesh.creation.icosphere(subdivisions=4)), (2, 3)):
+        bvh = outils3d.build_bvh(mesh.vertices, mesh.faces, leaf_size=leaf_size)
+        # Coordonnées arrondies au demi : beaucoup de rayons passent par des arêtes ou des sommets
+        # (égalités de t entre faces) ou ont des composantes de direction nulles
+        origins = np.round(rng.normal(size=(300, 3)) * 6) / 2
+        directions = np.round(rng.uniform(-1, 1, (300, 3)) * 2) / 2 - origins / 6
+        # Le dernier passe par un sommet de la sphère partagé par plusieurs feuilles
+        origins[:5] = [(0, 0, 5), (0.5, 0.5, 5), (0.5, 0, -5), (0, 0, 0), (0, 0, 6.5)]
+        directions[:5] = [(0, 0, -1), (0, 0, -1), (0, 0, 1), (1, 0, 0), (0, 0, -0.5 - 6.5 / 6)]
+        for t_min, t_max in ((0.0, np.inf), (1.0, 4.0)):
+            t, faces, uv = outils3d.intersect_rays_bvh(bvh, origins, directions, t_min, t_max)
+            for index in range(len(origins)):
+                single_t, face, (u, v) = outils3d.intersect_ray_bvh(bvh, origins[index], directions[index], t_min, t_max)
+                assert face == faces[index]
+                if face >= 0:
+                    np.testing.assert_allclose((single_t, u, v), (t[index], *uv[index]), rtol=0, atol=1e-12)
@@ -1,7 +1,13 @@
 import pyray as pr
+import sys
+import os
 import math
+import numpy as np
 from pyray import Vector3
 import random
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import draw_markers, unload_instancing_resources, create_idle_mode, wait_if_idle
 
 def initialize_camera():
     """Initialise la caméra 3D."""
@@ -14,61 +20,148 @@ def initialize_camera():
     )
     return camera
 
-def generate_maze_path(nb_segments, taille_grille=15, longueur_segment=1.0, activer_3d=False):
+def maze_path_stream(nb_segments, taille_grille=15, longueur_segment=1.0, activer_3d=False,
+                     chunk_size=4096, lookahead=4096):
+    """
+    Génère un chemin de labyrinthe sans auto-intersection par parcours en profondeur avec retour arrière (DFS).
+    Les cellules visitées sont marquées dans un bitset compact (1 bit par cellule, aucun tuple par cellule) :
+    une grille de 1000^3 cellules n'occupe que 125 Mo. Une impasse est abandonnée (retour arrière) au lieu
+    de perdre l'itération.
+
+    Le chemin part au hasard ; dès la première impasse, le voisin suivant est choisi par la règle de
+    Warnsdorff (le moins de voisins libres, tirage au hasard entre égalités) : le chemin longe les cellules
+    déjà prises au lieu d'y laisser des poches isolées, et la longueur demandée est atteinte dès que la grille
+    n'est pas presque remplie (par ex. 2000 segments sur 61x61, 5000 sur 101x101). Les cellules restent
+    marquées après un retour arrière (chaque cellule est visitée au plus une fois, le temps reste linéaire).
+    Si le parcours s'épuise avant la longueur demandée alors que rien n'a encore été émis, le chemin est
+    remplacé par un parcours en serpentin (boustrophédon) de toute la grille, qui part d'un coin : la longueur
+    est alors garantie dès que la grille contient nb_segments + 1 cellules. Seule limite restante : sur une
+    très grande grille presque remplie, si le parcours s'épuise après l'émission des premiers blocs, le plus
+    long chemin rencontré est retourné, plus court que demandé.
+
+    Les points sont produits au fil de l'eau par blocs (k,3) ; un point n'est émis qu'une fois
+    que le chemin l'a dépassé de `lookahead` pas, le retour arrière ne peut donc pas le remettre en cause.
+
+    :param nb_segments: Nombre de segments dans le chemin.
+    :param taille_grille: Demi-taille de la grille : les coordonnées restent dans [-taille_grille, taille_grille].
+    :param longueur_segment: Longueur de chaque segment.
+    :param activer_3d: Si True, permet un mouvement sur l'axe y pour un chemin en 3D.
+    :param chunk_size: Nombre de points par bloc émis.
+    :param lookahead: Nombre de pas conservés avant qu'un point soit émis.
+    :return: Générateur de tableaux (k,3) de coordonnées.
+    """
+    # Commence à un point aléatoire près de l'origine, au niveau du sol (y=0)
+    start = np.array([random.randint(-2, 2), 0, random.randint(-2, 2)], dtype=np.float64)
+
+    # Les points du chemin sont start + k * longueur_segment avec k entier, dans les limites de la grille
+    k_min = np.ceil((-taille_grille - start) / longueur_segment).astype(np.int64)
+    k_max = np.floor((taille_grille - start) / longueur_segment).astype(np.int64)
+    if not activer_3d:
+        k_min[1] = k_max[1] = 0
+    sizes = k_max - k_min + 1
+    stride_x = int(sizes[1] * sizes[2])
+    stride_y = int(sizes[2])
+    size_x, size_y, size_z = (int(size) for size in sizes)
+
+    visited = bytearray((size_x * size_y * size_z + 7) // 8)
+    current = int(-k_min[0]) * stride_x + int(-k_min[1]) * stride_y + int(-k_min[2])
+    visited[current >> 3] |= 1 << (current & 7)
+
+    stack = [current]  # Fin du chemin pas encore émise
+    emitted = 0
+    total = nb_segments + 1
+    best = [current]  # Plus longue fin de chemin rencontrée depuis la dernière émission
+
+    def to_points(indices):
+        """Convertit des indices linéaires de cellules en coordonnées (k,3)."""
+        indices = np.asarray(indices, dtype=np.int64)
+        ix, rest = np.divmod(indices, stride_x)
+        iy, iz = np.divmod(rest, stride_y)
+        cells = np.column_stack((ix, iy, iz)) + k_min
+        return start + cells * longueur_segment
+
+    def free_neighbours(cell):
+        """Voisins de la cellule dans les limites et non encore visités."""
+        ix, rest = divmod(cell, stride_x)
+        iy, iz = divmod(rest, stride_y)
+        neighbours = []
+        if ix + 1 < size_x:
+            neighbours.append(cell + stride_x)
+        if ix > 0:
+            neighbours.append(cell - stride_x)
+        if iz + 1 < size_z:
+            neighbours.append(cell + 1)
+        if iz > 0:
+            neighbours.append(cell - 1)
+        if iy + 1 < size_y:
+            neighbours.append(cell + stride_y)
+        if iy > 0:
+            neighbours.append(cell - stride_y)
+        return [n for n in neighbours if not visited[n >> 3] & (1 << (n & 7))]
+
+    stalled = False  # Passe à la règle de Warnsdorff après la première impasse
+    while emitted + len(stack) < total:
+        neighbours = free_neighbours(stack[-1])
+
+        if not neighbours:
+            # Impasse : la cellule reste marquée et on revient en arrière
+            stalled = True
+            if len(stack) > len(best):
+                best = stack[:]
+            stack.pop()
+            if not stack:
+                stack = best  # Grille épuisée : on garde le plus long chemin rencontré
+                break
+            continue
+
+        if stalled:
+            degrees = [len(free_neighbours(n)) for n in neighbours]
+            neighbours = [n for n, degree in zip(neighbours, degrees) if degree == min(degrees)]
+        following = random.choice(neighbours)
+        visited[following >> 3] |= 1 << (following & 7)
+        stack.append(following)
+
+        if len(stack) >= lookahead + chunk_size:
+            yield to_points(stack[:chunk_size])
+            del stack[:chunk_size]
+            emitted += chunk_size
+            best = stack[:1]
+
+    if emitted == 0 and len(stack) < total <= size_x * size_y * size_z:
+        # Rien n'est encore émis : serpentin sur toute la grille (chaque ligne, puis chaque plan,
+        # est parcourue dans le sens opposé à la précédente, deux cellules consécutives sont donc voisines)
+        for first in range(0, total, chunk_size):
+            steps = np.arange(first, min(first + chunk_size, total), dtype=np.int64)
+            ix, rest = np.divmod(steps, size_y * size_z)
+            iy, iz = np.divmod(rest, size_z)
+            line = ix * size_y + iy
+            iy = np.where(ix % 2 == 1, size_y - 1 - iy, iy)
+            iz = np.where(line % 2 == 1, size_z - 1 - iz, iz)
+            yield to_points(ix * stride_x + iy * stride_y + iz)
+        return
+
+    for i in range(0, len(stack), chunk_size):
+        yield to_points(stack[i:i + chunk_size])
+
+def generate_maze_path(nb_segments, taille_grille=15, longueur_segment=1.0, activer_3d=False, afficher_virages=False):
     """
     Génère un chemin ressemblant à un labyrinthe dans une grille centrée autour de l'origine.
-    Le chemin évite les auto-intersections et peut être généré en 2D ou en 3D.
+    Le chemin évite les auto-intersections et peut être généré en 2D ou en 3D (voir maze_path_stream).
 
     :param nb_segments: Nombre de segments dans le chemin.
     :param taille_grille: Taille de la grille pour limiter les mouvements du chemin.
     :param longueur_segment: Longueur de chaque segment.
     :param activer_3d: Si True, permet un mouvement sur l'axe y pour un chemin en 3D.
+    :param afficher_virages: Si True, affiche la direction de chaque virage (en une seule écriture).
     :return: Liste de points Vector3 représentant le chemin du labyrinthe.
     """
-    # Commence à un point aléatoire près de l'origine
-    start_x = random.randint(-2, 2)
-    start_z = random.randint(-2, 2)
-    start_y = 0  # Commence au niveau du sol (y=0)
-    
-    points = [Vector3(start_x, start_y, start_z)]
-    points_visites = {(start_x, start_y, start_z)}
-    
-    v1=Vector3(0,1,0)
-    v2=Vector3(0,0,0)
+    coordinates = np.concatenate(list(maze_path_stream(nb_segments, taille_grille, longueur_segment, activer_3d)))
+    points = [Vector3(*point) for point in coordinates.tolist()]
+
+    if afficher_virages:
+        _, turns = classify_turns(coordinates)
+        print("\n".join(TURN_LABELS[turn] for turn in turns.tolist()))
 
-    
-    # Directions : mouvement en 2D (x, z) ou en 3D (x, y, z)
-    directions = [(1, 0, 0), (-1, 0, 0), (0, 0, 1), (0, 0, -1)]
-    if activer_3d:
-        directions.extend([(0, 1, 0), (0, -1, 0)])  # Ajoute le mouvement sur l'axe y pour la 3D
-    
-    for _ in range(nb_segments):
-        # Choisir une direction aléatoire et calculer la nouvelle position
-        dx, dy, dz = random.choice(directions)
-        new_x = points[-1].x + dx * longueur_segment
-        new_y = points[-1].y + dy * longueur_segment
-        new_z = points[-1].z + dz * longueur_segment
-
-        # Vérifier que la nouvelle position est dans les limites et non revisitée
-        if (-taille_grille <= new_x <= taille_grille and 
-            -taille_grille <= new_y <= taille_grille and 
-            -taille_grille <= new_z <= taille_grille and
-            (new_x, new_y, new_z) not in points_visites):
-            
-            points.append(Vector3(new_x, new_y, new_z))
-            points_visites.add((new_x, new_y, new_z))
-        
-    for i in range( len(points)-2):
-        
-        a= points[i]
-        b= points[i+1]
-        c= points[i+2]
-        
-        (v,r)=check_turn_direction(a, b, c)
-        print(r)
-        
-
-        
     return points
 
 def draw_vector_3(start, end, color, thickness=0.05):
@@ -86,10 +179,11 @@ def draw_vector_3(start, end, color, thickness=0.05):
     pr.draw_cylinder_ex(start, end, thickness / 2, thickness / 2, 8, color)
     pr.draw_cylinder_ex(arrow_start, end, thickness * 2, thickness / 5, 8, color)
 
-def draw_points(points):
+def draw_points(points, camera=None):
+    """Dessine tous les points en un seul appel (sphères instanciées), en alternant rouge, vert et bleu."""
     colors = [pr.RED, pr.GREEN, pr.BLUE]
-    for i, point in enumerate(points):
-        pr.draw_sphere(point, 0.1, colors[i % len(colors)])
+    point_colors = [colors[i % len(colors)] for i in range(len(points))]
+    draw_markers(points, 0.1, point_colors, camera)
 
 def draw_vectors(points):
     for i in range(len(points) - 1):
@@ -122,7 +216,7 @@ def draw_scene(camera, grid_size, points, direction, turn):
     pr.begin_mode_3d(camera)
     
     pr.draw_grid(grid_size, 1)  # Dessine une grille pour référence
-    draw_points(points) # Dessine les points
+    draw_points(points, camera) # Dessine les points
     draw_vectors(points) # Dessine les vecteurs
 
     pr.end_mode_3d()
@@ -171,6 +265,170 @@ def check_turn_direction(a, b, c):
     else:
         return cross_AB_BC, "Collinéaire"    
 
+TURN_CLOCKWISE = -1
+TURN_COLLINEAR = 0
+TURN_COUNTERCLOCKWISE = 1
+TURN_LABELS = {TURN_COUNTERCLOCKWISE: "antihoraire", TURN_CLOCKWISE: "horaire", TURN_COLLINEAR: "Collinéaire"}
+
+def classify_turns(polyline, reference_normal=(0, 1, 0), tolerance=0.0):
+    """
+    Version par lot de check_turn_direction sur tous les triplets consécutifs d'une polyligne.
+
+    :param polyline: Tableau (N,3) des points de la polyligne.
+    :param reference_normal: Normale de référence ; (0, 1, 0) reproduit le test sur la composante y.
+    :param tolerance: Produit mixte en dessous duquel (en valeur absolue) le virage est considéré collinéaire.
+    :return: Tuple (produits vectoriels (N-2,3), classes int8 (N-2,)) avec TURN_COUNTERCLOCKWISE,
+             TURN_CLOCKWISE ou TURN_COLLINEAR.
+    """
+    polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 3)
+    if len(polyline) < 3:
+        return np.empty((0, 3)), np.empty(0, dtype=np.int8)
+    ab = polyline[1:-1] - polyline[:-2]
+    bc = polyline[2:] - polyline[1:-1]
+    crosses = np.cross(ab, bc)
+    projections = crosses @ np.asarray(reference_normal, dtype=np.float64)
+    turns = np.sign(projections).astype(np.int8)
+    turns[np.abs(projections) <= tolerance] = TURN_COLLINEAR
+    return crosses, turns
+
+INTERSECTION_TOLERANCE = 1e-9
+
+def segment_distances(a0, a1, b0, b1):
+    """
+    Distance minimale entre les segments [a0,a1] et [b0,b1], calculée par lot (tableaux (M,3)).
+    Les segments dégénérés (réduits à un point) sont gérés.
+    """
+    d1 = a1 - a0
+    d2 = b1 - b0
+    r = a0 - b0
+    a = np.einsum('ij,ij->i', d1, d1)
+    e = np.einsum('ij,ij->i', d2, d2)
+    f = np.einsum('ij,ij->i', d2, r)
+    c = np.einsum('ij,ij->i', d1, r)
+    b = np.einsum('ij,ij->i', d1, d2)
+    safe_a = np.where(a > 0, a, 1.0)
+    safe_e = np.where(e > 0, e, 1.0)
+
+    # Paramètre s sur le premier segment (0 si les segments sont parallèles)
+    denom = a * e - b * b
+    s = np.where(denom > 1e-12 * a * e, np.clip((b * f - c * e) / np.where(denom > 0, denom, 1.0), 0.0, 1.0), 0.0)
+    # Paramètre t sur le second, puis s recalculé si t a été borné
+    t = (b * s + f) / safe_e
+    s = np.where(t < 0, np.clip(-c / safe_a, 0.0, 1.0), np.where(t > 1, np.clip((b - c) / safe_a, 0.0, 1.0), s))
+    t = np.clip(t, 0.0, 1.0)
+
+    # Cas dégénérés : premier segment réduit à un point, puis second
+    s = np.where(a > 0, s, 0.0)
+    t = np.where(a > 0, t, np.clip(f / safe_e, 0.0, 1.0))
+    s = np.where((e > 0) | (a == 0), s, np.clip(-c / safe_a, 0.0, 1.0))
+    t = np.where(e > 0, t, 0.0)
+
+    delta = (a0 + d1 * s[:, None]) - (b0 + d2 * t[:, None])
+    return np.sqrt(np.einsum('ij,ij->i', delta, delta))
+
+def polyline_self_intersections(polyline, clearance=0.0, cell_size=None, min_separation=2,
+                                return_distances=False, pair_chunk=1 << 20):
+    """
+    Détecte les auto-intersections d'une polyligne (N,3) quelconque, ou les paires de segments
+    plus proches que `clearance`. Les segments sont rangés dans une table de hachage spatiale
+    (grille uniforme) : seules les paires partageant une cellule sont testées exactement, ce qui
+    donne un temps quasi linéaire tant que les segments ne couvrent que quelques cellules.
+
+    Chaque paire n'est testée qu'une fois : dans la cellule coin minimal de l'intersection
+    des boîtes des deux segments.
+
+    :param polyline: Tableau (N,3) des points de la polyligne.
+    :param clearance: Distance minimale requise entre deux segments (0 : intersections seules).
+    :param cell_size: Taille des cellules ; longueur médiane des segments (+ clearance) si None.
+    :param min_separation: Seules les paires (i, j) avec j - i >= min_separation sont testées ;
+                           les segments consécutifs (qui partagent un sommet) sont ignorés par défaut.
+    :param return_distances: Si True, retourne aussi la distance de chaque paire.
+    :param pair_chunk: Nombre maximal de paires candidates traitées à la fois (borne la mémoire).
+    :return: Tableau (M,2) trié des indices de segments en collision (segment i = points i et i+1),
+             suivi des distances (M,) si return_distances.
+    """
+    polyline = np.asarray(polyline, dtype=np.float64).reshape(-1, 3)
+    starts, ends = polyline[:-1], polyline[1:]
+    nb_segments = len(starts)
+    empty = np.empty((0, 2), dtype=np.int64)
+    if nb_segments < min_separation + 1:
+        return (empty, np.empty(0)) if return_distances else empty
+
+    # Boîtes des segments élargies de clearance / 2 : deux segments à moins de clearance se chevauchent
+    margin = clearance / 2.0 + INTERSECTION_TOLERANCE
+    box_min = np.minimum(starts, ends) - margin
+    box_max = np.maximum(starts, ends) + margin
+    origin = box_min.min(axis=0)
+    extent = box_max.max(axis=0) - origin
+    if cell_size is None:
+        lengths = np.linalg.norm(ends - starts, axis=1)
+        lengths = lengths[lengths > 0]
+        cell_size = (float(np.median(lengths)) if len(lengths) else 1.0) + clearance
+    # Les identifiants de cellules doivent tenir dans un int64
+    cell_size = max(cell_size, float(extent.max()) / (1 << 20), 1e-9)
+
+    cell_lo = np.floor((box_min - origin) / cell_size).astype(np.int64)
+    cell_hi = np.floor((box_max - origin) / cell_size).astype(np.int64)
+    dims = cell_hi.max(axis=0) + 1
+    spans = cell_hi - cell_lo + 1
+    counts = spans.prod(axis=1)
+
+    # Une entrée (segment, cellule) par cellule couverte par la boîte du segment
+    segment_ids = np.repeat(np.arange(nb_segments), counts)
+    local = np.arange(len(segment_ids)) - np.repeat(np.cumsum(counts) - counts, counts)
+    span_y, span_z = spans[segment_ids, 1], spans[segment_ids, 2]
+    offset_x, rest = np.divmod(local, span_y * span_z)
+    offset_y, offset_z = np.divmod(rest, span_z)
+    lo = cell_lo[segment_ids]
+    cell_ids = ((lo[:, 0] + offset_x) * dims[1] + lo[:, 1] + offset_y) * dims[2] + lo[:, 2] + offset_z
+    del local, span_y, span_z, offset_x, offset_y, offset_z, rest, lo
+
+    order = np.argsort(cell_ids, kind="stable")
+    cell_ids = cell_ids[order]
+    segment_ids = segment_ids[order]
+    # Pour chaque entrée, nombre d'entrées qui la suivent dans la même cellule
+    group_end = np.searchsorted(cell_ids, cell_ids, side="right")
+    partners = group_end - np.arange(len(cell_ids)) - 1
+    cumulative = np.cumsum(partners)
+
+    found_pairs = []
+    found_distances = []
+    threshold = clearance + INTERSECTION_TOLERANCE
+    first_entry = 0
+    while first_entry < len(cell_ids):
+        # Plage d'entrées dont les paires tiennent dans pair_chunk
+        base = cumulative[first_entry - 1] if first_entry else 0
+        last_entry = max(int(np.searchsorted(cumulative, base + pair_chunk, side="right")), first_entry + 1)
+        block = np.arange(first_entry, last_entry)
+        block_partners = partners[block]
+        first_entry = last_entry
+        if not block_partners.sum():
+            continue
+        first = np.repeat(block, block_partners)
+        second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(block_partners) - block_partners, block_partners)
+        i = segment_ids[first]
+        j = segment_ids[second]
+        i, j = np.minimum(i, j), np.maximum(i, j)
+        keep = j - i >= min_separation
+        # Déduplication : on ne garde la paire que dans la cellule coin minimal commun
+        corner = np.maximum(cell_lo[i[keep]], cell_lo[j[keep]])
+        corner_ids = (corner[:, 0] * dims[1] + corner[:, 1]) * dims[2] + corner[:, 2]
+        keep[keep] = corner_ids == cell_ids[first[keep]]
+        i, j = i[keep], j[keep]
+        # Rejet par boîtes avant le calcul exact
+        overlap = np.all((box_min[i] <= box_max[j]) & (box_min[j] <= box_max[i]), axis=1)
+        i, j = i[overlap], j[overlap]
+        distances = segment_distances(starts[i], ends[i], starts[j], ends[j])
+        hit = distances <= threshold
+        found_pairs.append(np.column_stack((i[hit], j[hit])))
+        found_distances.append(distances[hit])
+
+    pairs = np.concatenate(found_pairs) if found_pairs else empty
+    distances = np.concatenate(found_distances) if found_distances else np.empty(0)
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    pairs, distances = pairs[order], distances[order]
+    return (pairs, distances) if return_distances else pairs
+
 def update_camera_position(camera, movement_speed):
     """Met à jour la position de la caméra en fonction des touches pressées."""
     if pr.is_key_down(pr.KEY_W):
@@ -186,7 +444,7 @@ def update_camera_position(camera, movement_speed):
     if pr.is_key_down(pr.KEY_E):
         camera.position.y -= movement_speed
 
-def main():
+def main(idle=False):
     pr.init_window(800, 600, "Produit Vectoriel pour la Direction de Rotation")
     camera = initialize_camera()
     pr.set_target_fps(60)
@@ -207,13 +465,16 @@ def main():
     
     # Génère des points pour la spirale en zigzag
     points = generate_maze_path(50, int(grid_size/2), 1.0, False)
+    idle_mode = create_idle_mode(idle)
 
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed)
         draw_scene(camera, grid_size, points, direction, turn)
+        wait_if_idle(idle_mode)
 
+    unload_instancing_resources()
     pr.close_window()
 
 # Lancer le programme principal
 if __name__ == "__main__":
-    main()
+    main(idle="--idle" in sys.argv)
@@ -1,7 +1,16 @@
 import pyray as pr
+import sys
+import os
 import math
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from pyray import Vector3
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import draw_markers, points_to_array, unload_instancing_resources, get_mesh_bvh, intersect_rays_bvh
+from outils3d import get_mesh_transform, get_world_bvh, transform_points
+from outils3d import create_idle_mode, wait_if_idle
 
 def initialize_camera():
     """Initialise la caméra 3D."""
@@ -87,18 +96,18 @@ def draw_vector_3(start, end, color, thickness=0.05, head_size_factor=0.8):
     pr.draw_cylinder_ex(start, end, thickness / 2, thickness / 2, 8, color)
     pr.draw_cylinder_ex(arrow_start, end, thickness * 2, thickness / 5, 8, color)
 
-def draw_points(points):
+def draw_points(points, camera=None):
     
     fov_position = Vector3(0, 0, 0)
     fov_direction = Vector3(0, 0, 1)  # Vecteur directeur du cône
     fov_distance = 5
     fov_angle = 90
     
-    for point in points:
-        if is_point_in_fov(fov_position, fov_direction, fov_distance, fov_angle, point):
-            pr.draw_sphere(point, 0.1, pr.GREEN)
-        else : 
-            pr.draw_sphere(point, 0.1, pr.RED)
+    # Vert si le point est dans le FOV, rouge sinon ; toutes les sphères sont dessinées en un seul appel
+    fov = prepare_fov(fov_position, fov_direction, fov_distance, fov_angle)
+    in_fov = points_in_fov(fov, points_to_array(points))
+    colors = np.where(in_fov[:, np.newaxis], np.array(pr.GREEN), np.array(pr.RED))
+    draw_markers(points, 0.1, colors, camera)
 
 
 def draw_vectors(points):
@@ -171,6 +180,340 @@ def is_point_in_fov(fov_position, fov_direction, fov_distance, fov_angle, point)
     # TODO Vérifie si le produit scalaire satisfait la condition du FOV
     return scalar>=cos_half_fov
 
+def as_vector3_values(values):
+    """Arrondit des coordonnées comme leur stockage dans des Vector3 (float32), gardées en float64 pour les calculs."""
+    return np.asarray(values, dtype=np.float64).astype(np.float32).astype(np.float64)
+
+def normalize_as_vector3(vectors):
+    """
+    Version par lot de vector_normalize sur des tableaux (...,3) : longueur calculée en double dans le même
+    ordre que dot_product, division puis arrondi float32 du Vector3 résultat ; les vecteurs nuls restent nuls.
+    """
+    x, y, z = vectors[..., 0], vectors[..., 1], vectors[..., 2]
+    lengths = np.sqrt(x * x + y * y + z * z)
+    # Une longueur nulle implique un vecteur nul : le diviser par 1 donne bien le vecteur nul, sans masque
+    safe_lengths = np.where(lengths == 0, 1.0, lengths)
+    return as_vector3_values(vectors / safe_lengths[..., np.newaxis]), lengths
+
+def fov_contains(to_points, directions, fov_distances, cos_half):
+    """
+    Test de is_point_in_fov sur des tableaux, avec exactement les mêmes opérations et les mêmes arrondis :
+    to_points (...,3) déjà arrondis comme des Vector3, directions normalisées par normalize_as_vector3,
+    fov_distances et cos_half diffusables avec to_points[..., 0]. Les points à la frontière du FOV
+    reçoivent donc la même réponse que dans la version scalaire.
+
+    :return: Masque booléen de forme to_points.shape[:-1].
+    """
+    normalized, distances = normalize_as_vector3(to_points)
+    # dot_product(direction normalisée, vecteur normalisé), même ordre d'évaluation
+    scalars = (directions[..., 0] * normalized[..., 0] + directions[..., 1] * normalized[..., 1]
+               + directions[..., 2] * normalized[..., 2])
+    return (distances <= fov_distances) & (scalars >= cos_half)
+
+def prepare_fov(fov_position, fov_direction, fov_distance, fov_angle):
+    """
+    Précalcule une seule fois les grandeurs d'un FOV utilisées par points_in_fov :
+    direction normalisée (comme vector_normalize), distance au carré et cosinus de l'angle demi.
+
+    :param fov_position: Position du FOV (Vector3 ou séquence de 3 nombres).
+    :param fov_direction: Direction centrale du FOV (Vector3 ou séquence de 3 nombres).
+    :return: Dictionnaire décrivant le FOV.
+    """
+    direction, _ = normalize_as_vector3(as_vector3_values(vector3_to_array(fov_direction)))
+    cos_half_fov = math.cos(math.radians(fov_angle) / 2)
+    return {
+        "position": as_vector3_values(vector3_to_array(fov_position)),
+        "direction": direction,
+        "distance": fov_distance,
+        "angle": fov_angle,
+        "cos_half": cos_half_fov,
+    }
+
+OCCLUSION_EPSILON = 1e-6  # Marge relative sur le segment : un point posé sur une face ne se masque pas lui-même
+
+def points_occluded(origin, points, mesh, ray_chunk=1 << 16):
+    """
+    Indique pour chaque point si le segment qui le relie à origin traverse une face du mesh.
+    Les rayons sont lancés par lots de ray_chunk contre le BVH du mesh (construit une seule fois).
+    Comme pour pick_mesh, une matrice de modèle inversible ramène les segments dans l'espace du mesh ;
+    sinon le test se fait contre le BVH des sommets transformés.
+
+    :return: Masque booléen (N,), True si le point est caché.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    origin = vector3_to_array(origin)
+    transform = get_mesh_transform(mesh)
+    inverse = None
+    if transform is None:
+        bvh = get_mesh_bvh(mesh)
+    elif abs(np.linalg.det(transform[:3, :3])) > 1e-12:
+        # Transformation affine : les bornes du segment (0 à 1) sont les mêmes dans les deux espaces
+        inverse = np.linalg.inv(transform)
+        origin = transform_points(inverse, origin[np.newaxis])[0]
+        bvh = get_mesh_bvh(mesh)
+    else:
+        bvh = get_world_bvh(mesh)
+    occluded = np.zeros(len(points), dtype=bool)
+    for start in range(0, len(points), ray_chunk):
+        targets = points[start:start + ray_chunk]
+        if inverse is not None:
+            targets = transform_points(inverse, targets)
+        origins = np.broadcast_to(origin, targets.shape)
+        _, faces, _ = intersect_rays_bvh(bvh, origins, targets - origin,
+                                         OCCLUSION_EPSILON, 1 - OCCLUSION_EPSILON)
+        occluded[start:start + ray_chunk] = faces >= 0
+    return occluded
+
+def points_in_fov(fov, points, return_details=False, occluder=None):
+    """
+    Version par lot de is_point_in_fov : teste tous les points d'un tableau (N,3) en une fois.
+    Les coordonnées sont arrondies comme dans des Vector3 et le test reproduit les opérations de
+    is_point_in_fov (voir fov_contains) : le résultat est identique, y compris à la frontière du FOV.
+
+    :param fov: FOV préparé par prepare_fov.
+    :param points: Tableau (N,3) des points à vérifier.
+    :param return_details: Si True, retourne aussi les distances et les angles (en degrés) à l'axe du FOV.
+    :param occluder: Mesh trimesh optionnel ; les points dans le FOV mais cachés derrière une de ses faces
+                     sont alors considérés comme hors du champ de vision.
+    :return: Masque booléen (N,), ou tuple (masque, distances, angles) si return_details.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    to_points = as_vector3_values(as_vector3_values(points) - fov["position"])
+    mask = fov_contains(to_points, fov["direction"], fov["distance"], fov["cos_half"])
+    if occluder is not None:
+        # Seuls les points déjà dans le FOV sont testés contre le mesh
+        candidates = np.flatnonzero(mask)
+        mask[candidates[points_occluded(fov["position"], points[candidates], occluder)]] = False
+
+    if not return_details:
+        return mask
+    distances = np.sqrt(np.einsum('ij,ij->i', to_points, to_points))
+    cosines = np.zeros_like(distances)
+    nonzero = distances != 0
+    cosines[nonzero] = (to_points[nonzero] @ fov["direction"]) / distances[nonzero]
+    angles = np.degrees(np.arccos(np.clip(cosines, -1.0, 1.0)))
+    return mask, distances, angles
+
+def vector3_to_array(vector):
+    """Convertit un Vector3 (ou une séquence de 3 nombres) en tableau NumPy (3,)."""
+    if hasattr(vector, "x"):
+        return np.array([vector.x, vector.y, vector.z], dtype=np.float64)
+    return np.asarray(vector, dtype=np.float64).reshape(3)
+
+def build_point_grid(points, cell_size=None, points_per_cell=32):
+    """
+    Construit une grille uniforme sur un ensemble statique de points pour accélérer les requêtes
+    (cône de FOV, sphère, boîte). Seules les cellules occupées sont stockées.
+
+    :param points: Tableau (N,3) des points.
+    :param cell_size: Taille des cellules ; choisie pour avoir environ points_per_cell points par cellule si None.
+    :param points_per_cell: Nombre moyen de points visé par cellule quand cell_size est None.
+    :return: Dictionnaire décrivant la grille.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    origin = points.min(axis=0) if len(points) else np.zeros(3)
+    extent = (points.max(axis=0) - origin) if len(points) else np.zeros(3)
+    if cell_size is None:
+        volume = np.prod(np.maximum(extent, 1e-9))
+        nb_cells = max(len(points) / points_per_cell, 1.0)
+        cell_size = float(np.cbrt(volume / nb_cells))
+        cell_size = max(cell_size, float(extent.max()) / 1_000_000, 1e-9)
+
+    coords = np.floor((points - origin) / cell_size).astype(np.int64)
+    dims = coords.max(axis=0) + 1 if len(points) else np.ones(3, dtype=np.int64)
+    cell_ids = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+
+    # Points triés par cellule : chaque cellule occupée est une plage contiguë de order
+    order = np.argsort(cell_ids, kind="stable")
+    occupied, starts, counts = np.unique(cell_ids[order], return_index=True, return_counts=True)
+    cell_coords = np.column_stack((occupied // (dims[1] * dims[2]), (occupied // dims[2]) % dims[1], occupied % dims[2]))
+    cell_min = origin + cell_coords * cell_size
+    return {
+        "points": points,
+        "origin": origin,
+        "cell_size": cell_size,
+        "order": order,
+        "starts": starts,
+        "counts": counts,
+        "cell_min": cell_min,
+        "cell_max": cell_min + cell_size,
+    }
+
+def grid_candidates(grid, cell_mask):
+    """Retourne les indices (dans grid["points"]) des points contenus dans les cellules sélectionnées."""
+    starts = grid["starts"][cell_mask]
+    counts = grid["counts"][cell_mask]
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # Concaténation vectorisée des plages [start, start + count)
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return grid["order"][offsets + np.arange(total)]
+
+def grid_cells_distance_sq(grid, center):
+    """Distance au carré entre un point et la boîte de chaque cellule occupée."""
+    nearest = np.clip(center, grid["cell_min"], grid["cell_max"])
+    delta = nearest - center
+    return np.einsum('ij,ij->i', delta, delta)
+
+FOV_COSINE_SLACK = 1e-6  # Marge sur le cosinus lors de l'élimination des cellules (arrondis float32 du test exact)
+
+def query_grid_fov(grid, fov, occluder=None):
+    """
+    Retourne les indices triés des points de la grille dans le FOV préparé par prepare_fov.
+    Les cellules hors de portée ou hors du cône élargi par leur sphère englobante sont éliminées
+    avant tout test par point. L'élimination est élargie de la marge des arrondis float32 de
+    is_point_in_fov, et le test final est celui de points_in_fov : le résultat est identique à
+    is_point_in_fov appliqué à chaque point, y compris à la frontière du FOV.
+    Avec occluder, les points cachés par ce mesh sont exclus (voir points_in_fov).
+    """
+    position = fov["position"]
+    # Déplacement maximal d'un point ou du vecteur vers ce point par les arrondis float32
+    magnitude = max(np.abs(grid["cell_min"]).max(initial=0.0), np.abs(grid["cell_max"]).max(initial=0.0))
+    pad = 4 * float(np.finfo(np.float32).eps) * (magnitude + float(np.abs(position).max()))
+    reach = fov["distance"] + pad
+    cell_mask = grid_cells_distance_sq(grid, position) <= reach * reach
+
+    direction = fov["direction"]
+    if not direction.any():
+        if fov["cos_half"] > 0:
+            return np.empty(0, dtype=np.int64)  # Aucun point ne satisfait 0 >= cos
+    elif fov["cos_half"] > -1:
+        centers = (grid["cell_min"] + grid["cell_max"]) / 2
+        radius = math.sqrt(3) * grid["cell_size"] / 2 + pad
+        to_centers = centers - position
+        distances = np.sqrt(np.einsum('ij,ij->i', to_centers, to_centers))
+        far = distances > radius
+        cosines = np.einsum('ij,j->i', to_centers[far], direction) / distances[far]
+        bounds = np.minimum(math.radians(fov["angle"]) / 2 + np.arcsin(radius / distances[far]), math.pi)
+        in_cone = np.ones(len(centers), dtype=bool)
+        in_cone[far] = cosines >= np.cos(bounds) - FOV_COSINE_SLACK
+        cell_mask &= in_cone
+
+    candidates = grid_candidates(grid, cell_mask)
+    inside = points_in_fov(fov, grid["points"][candidates], occluder=occluder)
+    return np.sort(candidates[inside])
+
+def query_grid_sphere(grid, center, radius):
+    """Retourne les indices triés des points de la grille à une distance inférieure ou égale à radius de center."""
+    center = vector3_to_array(center)
+    candidates = grid_candidates(grid, grid_cells_distance_sq(grid, center) <= radius * radius)
+    delta = grid["points"][candidates] - center
+    inside = np.einsum('ij,ij->i', delta, delta) <= radius * radius
+    return np.sort(candidates[inside])
+
+def query_grid_aabb(grid, box_min, box_max):
+    """Retourne les indices triés des points de la grille contenus dans la boîte [box_min, box_max]."""
+    box_min = vector3_to_array(box_min)
+    box_max = vector3_to_array(box_max)
+    cell_mask = np.all((grid["cell_max"] >= box_min) & (grid["cell_min"] <= box_max), axis=1)
+    candidates = grid_candidates(grid, cell_mask)
+    points = grid["points"][candidates]
+    inside = np.all((points >= box_min) & (points <= box_max), axis=1)
+    return np.sort(candidates[inside])
+
+def fov_block_mask(fovs, targets):
+    """
+    Évalue un bloc d'observateurs contre un bloc de cibles avec le test exact de points_in_fov (fov_contains).
+
+    :param fovs: Dictionnaire de tableaux empilés (positions (m,3), directions (m,3), distances, cos_half),
+                 positions et directions préparées par prepare_fov.
+    :param targets: Tableau (n,3) des cibles, déjà arrondies par as_vector3_values.
+    :return: Masque booléen (m,n).
+    """
+    to_targets = as_vector3_values(targets[np.newaxis, :, :] - fovs["positions"][:, np.newaxis, :])
+    return fov_contains(to_targets, fovs["directions"][:, np.newaxis, :], fovs["distances"][:, np.newaxis],
+                        fovs["cos_half"][:, np.newaxis])
+
+visibility_worker_targets = None
+
+def init_visibility_worker(targets):
+    """Initialise un processus de calcul : les cibles ne sont transmises qu'une fois par processus."""
+    global visibility_worker_targets
+    visibility_worker_targets = targets
+
+def visibility_chunk(fovs, output, target_chunk, targets=None):
+    """
+    Calcule la visibilité d'un paquet d'observateurs sur toutes les cibles, par blocs de target_chunk cibles.
+
+    :return: Lignes (m,N) de la matrice de visibilité si output vaut "matrix", sinon compteurs (N,) par cible.
+    """
+    if targets is None:
+        targets = visibility_worker_targets
+    nb_observers = len(fovs["positions"])
+    if output == "matrix":
+        result = np.empty((nb_observers, len(targets)), dtype=bool)
+    else:
+        result = np.zeros(len(targets), dtype=np.int64)
+    for start in range(0, len(targets), target_chunk):
+        block = fov_block_mask(fovs, targets[start:start + target_chunk])
+        if output == "matrix":
+            result[:, start:start + target_chunk] = block
+        else:
+            result[start:start + target_chunk] = block.sum(axis=0)
+    return result
+
+def visibility_matrix(observer_positions, observer_directions, fov_distance, fov_angle, targets,
+                      output="matrix", max_pairs=1 << 20, workers=None):
+    """
+    Évalue M observateurs (FOV) contre N cibles par blocs de taille bornée.
+
+    :param observer_positions: Tableau (M,3) des positions des observateurs.
+    :param observer_directions: Tableau (M,3) des directions des observateurs.
+    :param fov_distance: Portée du FOV, commune ou tableau (M,).
+    :param fov_angle: Angle du FOV en degrés, commun ou tableau (M,).
+    :param targets: Tableau (N,3) des cibles.
+    :param output: "matrix" pour la matrice booléenne (M,N), "counts" pour le nombre d'observateurs voyant chaque cible.
+    :param max_pairs: Nombre maximal de couples observateur-cible évalués par bloc (borne la mémoire).
+    :param workers: Nombre de processus ; None ou 1 pour un calcul dans le processus courant.
+    :return: Tuple (résultat, statistiques) ; les statistiques donnent le débit en couples par seconde.
+    """
+    if output not in ("matrix", "counts"):
+        raise ValueError(f"Sortie inconnue : {output!r} (attendu : matrix, counts)")
+    start_time = time.perf_counter()
+
+    positions = np.asarray(observer_positions, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(observer_directions, dtype=np.float64).reshape(-1, 3)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 3)
+    nb_observers = len(positions)
+    distances = np.broadcast_to(np.asarray(fov_distance, dtype=np.float64), (nb_observers,))
+    angles = np.broadcast_to(np.asarray(fov_angle, dtype=np.float64), (nb_observers,))
+    prepared = [prepare_fov(positions[i], directions[i], distances[i], angles[i]) for i in range(nb_observers)]
+    targets = as_vector3_values(targets)  # Arrondies une seule fois, comme des Vector3
+    fovs = {
+        "positions": np.array([fov["position"] for fov in prepared]).reshape(-1, 3),
+        "directions": np.array([fov["direction"] for fov in prepared]).reshape(-1, 3),
+        "distances": np.array([fov["distance"] for fov in prepared], dtype=np.float64),
+        "cos_half": np.array([fov["cos_half"] for fov in prepared], dtype=np.float64),
+    }
+
+    target_chunk = max(1, min(len(targets), max_pairs))
+    observer_chunk = max(1, max_pairs // target_chunk)
+    chunks = [{key: value[i:i + observer_chunk] for key, value in fovs.items()}
+              for i in range(0, nb_observers, observer_chunk)]
+
+    if workers is None or workers <= 1:
+        results = [visibility_chunk(chunk, output, target_chunk, targets) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_visibility_worker,
+                                 initargs=(targets,)) as executor:
+            results = list(executor.map(visibility_chunk, chunks,
+                                        [output] * len(chunks), [target_chunk] * len(chunks)))
+
+    if output == "matrix":
+        result = np.concatenate(results) if results else np.empty((0, len(targets)), dtype=bool)
+    else:
+        result = np.sum(results, axis=0) if results else np.zeros(len(targets), dtype=np.int64)
+
+    seconds = time.perf_counter() - start_time
+    pairs = nb_observers * len(targets)
+    stats = {
+        "pairs": pairs,
+        "seconds": seconds,
+        "pairs_per_second": pairs / seconds if seconds > 0 else math.inf,
+    }
+    return result, stats
+
 def drawPara(vect1,vect2):
     # Dessine les vecteurs
     origin=pr.Vector3(0,0,0)
@@ -192,7 +535,7 @@ def drawPara(vect1,vect2):
         pr.draw_triangle_3d(origin, vect2, vect1, pr.fade(pr.VIOLET, 0.5))
         pr.draw_triangle_3d(vect2, vect3, vect1, pr.fade(pr.VIOLET, 0.5))
     
-def main():
+def main(idle=False):
     pr.init_window(800, 600, "FOV")
     camera = initialize_camera()
     pr.set_target_fps(60)
@@ -214,7 +557,7 @@ def main():
     vect=cross_product(point_c, point_a)
     print(vect.x," ",vect.y," ",vect.z)
     print(is_point_in_fov(fov_position, fov_direction, fov_distance, fov_angle, point_a))
-
+    idle_mode = create_idle_mode(idle)
 
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed)
@@ -223,17 +566,19 @@ def main():
         pr.begin_mode_3d(camera)
         
         pr.draw_grid(grid_size, 1)  # Dessine une grille pour référence
-        draw_points([point_a, point_b, point_c,point_d])
-        draw_points(points)
+        draw_points([point_a, point_b, point_c,point_d], camera)
+        draw_points(points, camera)
         draw_fov_cone(fov_position, fov_direction, fov_distance, fov_angle)
         
         drawPara(point_e, point_f)
 
         pr.end_mode_3d()
         pr.end_drawing()
+        wait_if_idle(idle_mode)
 
+    unload_instancing_resources()
     pr.close_window()
 
 # Lancer le programme principal
 if __name__ == "__main__":
-    main()
+    main(idle="--idle" in sys.argv)
@@ -0,0 +1,27 @@
+"""Vérifications de maze_path_stream (lancer avec python -m pytest)."""
+import random
+
+import numpy as np
+import pytest
+
+from exo1 import maze_path_stream
+
+
+@pytest.mark.parametrize("nb_segments, taille_grille, activer_3d", [
+    (2000, 30, False),   # 61x61, cas signalés en revue
+    (5000, 50, False),   # 101x101
+    (224, 7, False),     # 15x15 : toutes les cellules sauf une
+    (342, 3, True),      # 7x7x7 : toutes les cellules sauf une
+    (1000, 6, True),
+])
+def test_maze_path_reaches_requested_length(nb_segments, taille_grille, activer_3d):
+    """Le chemin a exactement nb_segments segments unitaires, reste dans la grille et ne se recoupe pas."""
+    for seed in range(5):
+        random.seed(seed)
+        path = np.concatenate(list(maze_path_stream(nb_segments, taille_grille, 1.0, activer_3d)))
+        assert len(path) == nb_segments + 1
+        np.testing.assert_allclose(np.abs(np.diff(path, axis=0)).sum(axis=1), 1.0)
+        assert len(np.unique(path, axis=0)) == len(path)
+        assert np.all(np.abs(path) <= taille_grille)
+        if not activer_3d:
+            assert np.all(path[:, 1] == 0)
@@ -0,0 +1,75 @@
+"""Vérifications des requêtes de FOV de exo2 contre is_point_in_fov (lancer avec python -m pytest)."""
+import itertools
+
+import numpy as np
+import pytest
+import trimesh
+from pyray import Vector3
+
+from exo2 import (build_point_grid, is_point_in_fov, points_in_fov, points_occluded, prepare_fov, query_grid_fov,
+                  visibility_matrix)
+from outils3d import set_mesh_transform, transform_points
+
+FOV_ANGLES = (0, 45, 90, 120, 180, 270, 360)
+FOV_DIRECTIONS = ((0, 0, 1), (1, 1, 0), (1, 2, 3), (-2, 1, 0), (0, 0, 0))
+FOV_POSITIONS = ((0, 0, 0), (1, -1, 2))
+
+
+def integer_lattice(half_size=3):
+    """Points entiers de [-half_size, half_size]^3 : beaucoup tombent exactement sur la frontière des FOV."""
+    values = np.arange(-half_size, half_size + 1, dtype=np.float64)
+    return np.array(list(itertools.product(values, values, values)))
+
+
+def reference_mask(position, direction, distance, angle, points):
+    """Résultat de is_point_in_fov point par point."""
+    return np.array([is_point_in_fov(Vector3(*position), Vector3(*direction), distance, angle, Vector3(*point))
+                     for point in points.tolist()])
+
+
+@pytest.mark.parametrize("position", FOV_POSITIONS)
+@pytest.mark.parametrize("direction", FOV_DIRECTIONS)
+@pytest.mark.parametrize("angle", FOV_ANGLES)
+def test_points_in_fov_matches_reference_on_lattice(position, direction, angle):
+    points = integer_lattice()
+    fov = prepare_fov(Vector3(*position), Vector3(*direction), 3, angle)
+    np.testing.assert_array_equal(points_in_fov(fov, points), reference_mask(position, direction, 3, angle, points))
+
+
+@pytest.mark.parametrize("cell_size", [None, 0.5, 1.0, 2.5])
+@pytest.mark.parametrize("direction", FOV_DIRECTIONS)
+@pytest.mark.parametrize("angle", FOV_ANGLES)
+def test_query_grid_fov_matches_reference_on_lattice(cell_size, direction, angle):
+    points = integer_lattice()
+    grid = build_point_grid(points, cell_size=cell_size)
+    for position in FOV_POSITIONS:
+        fov = prepare_fov(Vector3(*position), Vector3(*direction), 3, angle)
+        expected = np.flatnonzero(reference_mask(position, direction, 3, angle, points))
+        np.testing.assert_array_equal(query_grid_fov(grid, fov), expected)
+
+
+@pytest.mark.parametrize("angle", FOV_ANGLES)
+def test_visibility_matrix_matches_reference_on_lattice(angle):
+    points = integer_lattice(2)
+    positions = np.array(FOV_POSITIONS * len(FOV_DIRECTIONS), dtype=np.float64)
+    directions = np.repeat(np.array(FOV_DIRECTIONS, dtype=np.float64), len(FOV_POSITIONS), axis=0)
+    matrix, _ = visibility_matrix(positions, directions, 3, angle, points, max_pairs=1000)
+    expected = np.array([reference_mask(position, direction, 3, angle, points)
+                         for position, direction in zip(positions.tolist(), directions.tolist())])
+    np.testing.assert_array_equal(matrix, expected)
+
+
+@pytest.mark.parametrize("scale", [(2.0, 0.5, 1.5), (2.0, 0.5, 0.0)])
+def test_points_occluded_follows_model_matrix(scale):
+    """L'occultation tient compte de la matrice de modèle, inversible ou non, comme un mesh déjà transformé."""
+    transform = np.diag(scale + (1.0,))
+    transform[:3, 3] = (1.0, -0.5, 0.25)
+    occluder = trimesh.creation.icosphere(subdivisions=2)
+    set_mesh_transform(occluder, transform)
+    baked = trimesh.Trimesh(transform_points(transform, occluder.vertices), occluder.faces, process=False)
+    points = np.random.default_rng(0).uniform(-4, 4, (500, 3))
+    origin = (-3.0, 0.2, 0.1)
+
+    occluded = points_occluded(origin, points, occluder, ray_chunk=64)
+    np.testing.assert_array_equal(occluded, points_occluded(origin, points, baked))
+    assert occluded.any() and not occluded.all()
@@ -1,7 +1,15 @@
 import pyray as pr
+import sys
+import os
 import math
+import numpy as np
 from pyray import Vector3
-import trimesh
+
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import load_cached_mesh, compute_face_normals_array, compute_vertex_normals_array
+from outils3d import draw_mesh_model, draw_mesh_wireframe, draw_mesh_markers, unload_mesh_model, unload_instancing_resources
+from outils3d import pick_mesh_with_mouse, draw_selection, create_idle_mode, wait_if_idle
 
 def initialize_camera():
     """Initialise la caméra 3D."""
@@ -29,11 +37,6 @@ def update_camera_position(camera, movement_speed):
     if pr.is_key_down(pr.KEY_E):
         camera.position.y -= movement_speed
 
-def load_ply_file(file_path):
-    """Charge un fichier PLY et retourne le mesh en tant que structure de données trimesh."""
-    mesh = trimesh.load(file_path)
-    return mesh
-
 def cross_product(A, B):
     return Vector3(A.y*B.z-A.z*B.y,-(A.x*B.z-A.z*B.x) , A.x*B.y - A.y*B.x)
 
@@ -51,6 +54,123 @@ def dot_product(A, B):
     """Calcule le produit scalaire entre deux vecteurs A et B."""
     return A.x*B.x + A.y*B.y +  A.z*B.z
 
+class Vec3Array:
+    """
+    Lot de N vecteurs 3D stocké dans un seul tampon NumPy (N,3) de float32 ou float64.
+    Les opérations (produit vectoriel, scalaire, longueur, normalisation, rotation) sont calculées
+    sur tout le lot d'un coup, sans créer de Vector3 par élément.
+    """
+
+    def __init__(self, data, dtype=None):
+        """
+        Enveloppe data sans copie s'il s'agit déjà d'un tableau (N,3) de float32 ou float64.
+        Sans dtype, le type flottant de data est conservé ; les autres entrées sont converties en float64.
+        """
+        data = np.asarray(data)
+        if dtype is None:
+            dtype = data.dtype if data.dtype in (np.float32, np.float64) else np.float64
+        self.data = np.asarray(data, dtype=dtype).reshape(-1, 3)
+
+    @classmethod
+    def from_vectors(cls, vectors, dtype=np.float64):
+        """Construit le lot à partir d'une liste de Vector3."""
+        return cls(np.array([(v.x, v.y, v.z) for v in vectors], dtype=dtype).reshape(-1, 3))
+
+    @classmethod
+    def from_mesh(cls, mesh):
+        """Vue sans copie sur mesh.vertices."""
+        return cls(np.asarray(mesh.vertices).view(np.ndarray))
+
+    def to_vectors(self):
+        """Convertit le lot en liste de Vector3 (pour les fonctions de dessin pyray)."""
+        return [Vector3(*v) for v in self.data.tolist()]
+
+    def to_mesh(self, mesh):
+        """Remplace les sommets du mesh par le contenu du lot."""
+        mesh.vertices = self.data
+
+    @property
+    def x(self):
+        return self.data[:, 0]
+
+    @property
+    def y(self):
+        return self.data[:, 1]
+
+    @property
+    def z(self):
+        return self.data[:, 2]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        """Un entier donne un Vector3, une tranche ou un masque donne un Vec3Array."""
+        if isinstance(index, (int, np.integer)):
+            return Vector3(*self.data[index].tolist())
+        return Vec3Array(self.data[index], dtype=self.data.dtype)
+
+    def __repr__(self):
+        return f"Vec3Array({self.data!r})"
+
+    def _operand(self, other):
+        """Convertit other (Vec3Array, Vector3, tableau ou scalaire) en tableau diffusable avec le lot."""
+        if isinstance(other, Vec3Array):
+            return other.data
+        if hasattr(other, "x") and hasattr(other, "y") and hasattr(other, "z"):
+            return np.array([other.x, other.y, other.z], dtype=self.data.dtype)
+        return np.asarray(other, dtype=self.data.dtype)
+
+    def __add__(self, other):
+        return Vec3Array(self.data + self._operand(other), dtype=self.data.dtype)
+
+    def __sub__(self, other):
+        return Vec3Array(self.data - self._operand(other), dtype=self.data.dtype)
+
+    def __mul__(self, other):
+        """Produit par un scalaire, un vecteur (par composante) ou un tableau (N,1) de facteurs par vecteur."""
+        return Vec3Array(self.data * self._operand(other), dtype=self.data.dtype)
+
+    __rmul__ = __mul__
+
+    def scale_each(self, factors):
+        """Multiplie chaque vecteur par son propre facteur (factors : N valeurs)."""
+        factors = np.asarray(factors, dtype=self.data.dtype).reshape(-1)
+        if factors.shape[0] != len(self.data):
+            raise ValueError(f"scale_each attend {len(self.data)} facteurs, reçu {factors.shape[0]}")
+        return Vec3Array(self.data * factors[:, np.newaxis], dtype=self.data.dtype)
+
+    def cross(self, other):
+        """Produit vectoriel élément par élément (ou avec un seul vecteur)."""
+        return Vec3Array(np.cross(self.data, self._operand(other)), dtype=self.data.dtype)
+
+    def dot(self, other):
+        """Produit scalaire élément par élément ; retourne un tableau (N,)."""
+        other = np.broadcast_to(self._operand(other), self.data.shape)
+        return np.einsum('ij,ij->i', self.data, other)
+
+    def length(self):
+        """Longueur de chaque vecteur ; retourne un tableau (N,)."""
+        return np.sqrt(np.einsum('ij,ij->i', self.data, self.data))
+
+    def normalize(self):
+        """Normalise chaque vecteur ; les vecteurs nuls restent nuls comme dans vector_normalize."""
+        lengths = self.length()
+        result = np.zeros_like(self.data)
+        valid = lengths != 0
+        result[valid] = self.data[valid] / lengths[valid, np.newaxis]
+        return Vec3Array(result, dtype=self.data.dtype)
+
+    def rotate(self, axis, angle):
+        """Fait tourner tous les vecteurs autour d'un axe (règle de la main droite, formule de Rodrigues), angle en radians."""
+        k = self._operand(axis).astype(np.float64)
+        k = k / np.linalg.norm(k)
+        cos_a = math.cos(angle)
+        sin_a = math.sin(angle)
+        rotated = (self.data * cos_a + np.cross(k, self.data) * sin_a
+                   + np.outer(self.data @ k, k) * (1 - cos_a))
+        return Vec3Array(rotated, dtype=self.data.dtype)
+
 def compute_face_center(v0, v1, v2):
     """Calcule le centre d'une face triangulaire."""
     return Vector3(
@@ -59,65 +179,35 @@ def compute_face_center(v0, v1, v2):
         (v0.z + v1.z + v2.z) / 3
     )
 
-def compute_vertex_normals(mesh, face_normals):
+def compute_vertex_normals(mesh, face_normals, weighting="uniform"):
     """
     Calcule les normales pour chaque sommet en moyennant les normales des faces adjacentes.
-    Retourne un dictionnaire avec chaque sommet et son vecteur normal associé.
+    Accepte les normales des faces en liste de tuples (centre, normale) ou en tableau (F,3).
+    Retourne un tableau (V,3) avec le vecteur normal de chaque sommet.
     """
-    
-    # TODO : mettre en œuvre le calcul des normales pour chaque sommet en moyennant les normales des faces adjacentes
-    vertex_normals = {i: Vector3(0, 0, 0) for i in range(len(mesh.vertices))}
-    vertex_count = {i: 0 for i in range(len(mesh.vertices))}
-
-    for face, (_, normal) in zip(mesh.faces, face_normals):
-        for vertex_index in face:
-            vertex_normals[vertex_index].x += normal.x
-            vertex_normals[vertex_index].y += normal.y
-            vertex_normals[vertex_index].z += normal.z
-            vertex_count[vertex_index] += 1
-
-    # TODO : Moyenne les normales (n'oubliez pas de normaliser)
-    for i in vertex_normals:
-        if vertex_count[i] > 0:
-            vertex_normals[i].x /= vertex_count[i]
-            vertex_normals[i].y /= vertex_count[i]
-            vertex_normals[i].z /= vertex_count[i]
-            
-            # TODO: Normalisation
-            vertex_normals[i]=vector_normalize(vertex_normals[i])
-
-    return vertex_normals
+    if not isinstance(face_normals, np.ndarray):
+        face_normals = np.array([(normal.x, normal.y, normal.z) for _, normal in face_normals], dtype=np.float64)
+    return compute_vertex_normals_array(mesh.vertices, mesh.faces, face_normals, weighting)
+
+def face_normals_as_tuples(centers, normals):
+    """Convertit les tableaux (F,3) de centres et de normales en liste de tuples (centre, normale) de Vector3."""
+    return [(Vector3(*center), Vector3(*normal)) for center, normal in zip(centers.tolist(), normals.tolist())]
 
 def compute_face_normals(mesh):
     """Calcule les normales pour chaque face du mesh et retourne une liste de tuples (centre, normale)."""
-    normals = []
-    for face in mesh.faces:
-        v0 = Vector3(*mesh.vertices[face[0]])
-        v1 = Vector3(*mesh.vertices[face[1]])
-        v2 = Vector3(*mesh.vertices[face[2]])
-
-        # TODO : Calculer le vecteur normal de la face
-        edge1 = Vector3(v1.x-v0.x,v1.y-v0.y,v1.z-v0.z) 
-        edge2 = Vector3(v2.x-v0.x,v2.y-v0.y,v2.z-v0.z)
-        normal = cross_product(edge1, edge2)
-        normal = vector_normalize(normal)
-
-        # Calculer le centre de la face
-        center = compute_face_center(v0, v1, v2)
-        
-        normals.append((center, normal))
-    return normals
+    centers, normals = compute_face_normals_array(mesh.vertices, mesh.faces)
+    return face_normals_as_tuples(centers, normals)
 
 def draw_vertex_normals(mesh, vertex_normals):
     """
     Dessine les normales des sommets comme des vecteurs à partir de chaque sommet.
     """
-    for vertex_index, normal in vertex_normals.items():
-        start_point = Vector3(*mesh.vertices[vertex_index])
+    for vertex, normal in zip(mesh.vertices.tolist(), np.asarray(vertex_normals).tolist()):
+        start_point = Vector3(*vertex)
         end_point = Vector3(
-            start_point.x + normal.x * 0.5,
-            start_point.y + normal.y * 0.5,
-            start_point.z + normal.z * 0.5
+            start_point.x + normal[0] * 0.5,
+            start_point.y + normal[1] * 0.5,
+            start_point.z + normal[2] * 0.5
         )
         draw_vector_3(start_point, end_point, pr.GREEN)  # Dessine le vecteur normal en vert
 
@@ -140,24 +230,16 @@ def draw_edge(start, end, color, thickness=0.05):
     """Dessine une arête comme un cylindre."""
     pr.draw_cylinder_ex(start, end, thickness / 2, thickness / 2, 8, color)
 
-def draw_mesh(mesh):
+def draw_mesh(mesh, camera=None):
     """Dessine le mesh complet avec sommets, arêtes et faces."""
-    # Dessine les faces sous forme de triangles
-    for face in mesh.faces:
-        v0 = Vector3(*mesh.vertices[face[0]])
-        v1 = Vector3(*mesh.vertices[face[1]])
-        v2 = Vector3(*mesh.vertices[face[2]])
-        pr.draw_triangle_3d(v0, v1, v2, pr.LIGHTGRAY)  # Dessine la face comme un triangle rempli
+    # Dessine les faces en un seul appel à partir du modèle présent sur le GPU
+    draw_mesh_model(mesh, pr.LIGHTGRAY)
     
-    # Dessine les arêtes
-    for edge in mesh.edges:
-        v_start = Vector3(*mesh.vertices[edge[0]])
-        v_end = Vector3(*mesh.vertices[edge[1]])
-        draw_edge(v_start, v_end, pr.BLACK)  # Dessine l'arête
+    # Dessine les arêtes uniques comme des cylindres instanciés
+    draw_mesh_wireframe(mesh, pr.BLACK, thickness=0.05)
     
-    # Dessine les sommets
-    for vertex in mesh.vertices:
-        pr.draw_sphere(Vector3(*vertex), 0.05, pr.RED)  # Dessine les sommets comme de petites sphères
+    # Dessine les sommets comme de petites sphères instanciées
+    draw_mesh_markers(mesh, 0.05, pr.RED, camera)
 
 def draw_face_normals(face_normals):
     """Dessine les normales des faces comme des vecteurs à partir du centre de chaque face."""
@@ -169,7 +251,7 @@ def draw_face_normals(face_normals):
         )
         draw_vector_3(center, end_point, pr.BLUE)  # Dessine le vecteur normal
 
-def main():
+def main(idle=False):
     pr.init_window(1000, 800, "PLY Viewer with Normals")
     camera = initialize_camera()
     pr.set_target_fps(60)
@@ -177,25 +259,35 @@ def main():
 
     # Charge et affiche le fichier PLY
     ply_file_path = "dolphin.ply"  # Remplacez par le chemin de votre fichier PLY
-    mesh = load_ply_file(ply_file_path)
-    face_normals = compute_face_normals(mesh)
-    vertex_normals = compute_vertex_normals(mesh, face_normals)
+    mesh, cached = load_cached_mesh(ply_file_path)  # Normales lues depuis le cache disque
+    face_normals = face_normals_as_tuples(cached["face_centers"], cached["face_normals"])
+    vertex_normals = cached["vertex_normals"]
+    selection = None
+    idle_mode = create_idle_mode(idle)
 
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed)
+        if pr.is_mouse_button_pressed(pr.MOUSE_BUTTON_LEFT):
+            selection = pick_mesh_with_mouse(mesh, camera)  # Sélectionne la face sous la souris
         pr.begin_drawing()
         pr.clear_background(pr.RAYWHITE)
         pr.begin_mode_3d(camera)
         
-        draw_mesh(mesh)              # Affiche les sommets, arêtes et faces du fichier PLY
+        draw_mesh(mesh, camera)      # Affiche les sommets, arêtes et faces du fichier PLY
         draw_face_normals(face_normals)  # Affiche les normales des faces
         draw_vertex_normals(mesh, vertex_normals)  # Affiche les normales des sommets
+        draw_selection(mesh, selection)  # Affiche la face et le sommet sélectionnés
 
         pr.end_mode_3d()
+        if selection is not None:
+            pr.draw_text(f"Face : {selection['face']}  Sommet : {selection['vertex']}", 10, 10, 20, pr.BLACK)
         pr.end_drawing()
+        wait_if_idle(idle_mode)
 
+    unload_mesh_model(mesh)
+    unload_instancing_resources()
     pr.close_window()
 
 # Lancer le programme principal
 if __name__ == "__main__":
-    main()
+    main(idle="--idle" in sys.argv)
@@ -1,9 +1,15 @@
 import pyray as pr
+import sys
+import os
 import numpy as np
 import math
 from pyray import Vector3
-import trimesh
 from  exo3 import cross_product , vector_length, vector_normalize, dot_product
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import load_cached_mesh, draw_mesh_model, draw_mesh_wireframe, draw_mesh_markers
+from outils3d import unload_mesh_model, unload_instancing_resources
+from outils3d import create_idle_mode, wait_if_idle, set_mesh_transform, export_mesh
 
 def initialize_camera():
     """Initialise la caméra 3D."""
@@ -79,26 +85,13 @@ def draw_transformation_axis(origin, axis, scale=3):
     scaled_axis = Vector3(origin.x + axis.x * scale, origin.y + axis.y * scale, origin.z + axis.z * scale)
     draw_vector_3(origin, scaled_axis, pr.PURPLE, thickness=0.05)
 
-def draw_mesh(mesh):
+def draw_mesh(mesh, camera=None):
     """Dessine le mesh complet avec sommets, arêtes et faces."""
-    for face in mesh.faces:
-        v0 = Vector3(*mesh.vertices[face[0]])
-        v1 = Vector3(*mesh.vertices[face[1]])
-        v2 = Vector3(*mesh.vertices[face[2]])
-        pr.draw_triangle_3d(v0, v1, v2, pr.LIGHTGRAY)
+    draw_mesh_model(mesh, pr.LIGHTGRAY)
     
-    for edge in mesh.edges:
-        v_start = Vector3(*mesh.vertices[edge[0]])
-        v_end = Vector3(*mesh.vertices[edge[1]])
-        pr.draw_line_3d(v_start, v_end, pr.BLACK)
+    draw_mesh_wireframe(mesh, pr.BLACK)
     
-    for vertex in mesh.vertices:
-        pr.draw_sphere(Vector3(*vertex), 0.05, pr.RED)
-
-def load_ply_file(file_path):
-    """Charge un fichier PLY et retourne le mesh en tant que structure de données trimesh."""
-    mesh = trimesh.load(file_path)
-    return mesh
+    draw_mesh_markers(mesh, 0.05, pr.RED, camera)
 
 def initialize_mesh_for_transforming(mesh):
     """Stocke les sommets originaux du mesh pour permettre un redimensionnement dynamique."""
@@ -133,11 +126,44 @@ def orthographic_projection_matrix(axis):
         [-n.x*n.z,  -n.y*n.z,  1-n.z**2]
     ])
 
-def apply_transformations(mesh, rotation_mat, scaling_mat, projection_mat):
-    """Applique les transformations de rotation, de mise à l'échelle et de projection aux sommets du mesh."""
-    mesh.vertices = mesh.original_vertices @ rotation_mat.T @ scaling_mat.T @ projection_mat.T
+def compose_transformations(rotation_mat, scaling_mat, projection_mat):
+    """Compose les matrices 3x3 dans l'ordre d'application (rotation, échelle, projection)."""
+    return projection_mat @ scaling_mat @ rotation_mat
+
+def get_transform_buffer(mesh):
+    """Retourne le tampon (N,3) réutilisé pour les sommets transformés ; recréé seulement si original_vertices change."""
+    buffer = getattr(mesh, "transform_buffer", None)
+    if buffer is None or buffer.shape != mesh.original_vertices.shape:
+        buffer = np.empty(mesh.original_vertices.shape)
+        mesh.transform_buffer = buffer
+    return buffer
+
+def apply_transformations(mesh, rotation_mat, scaling_mat, projection_mat, transform_vertices=False):
+    """
+    Applique les transformations de rotation, de mise à l'échelle et de projection aux sommets du mesh.
+
+    Par défaut la matrice composée est confiée au GPU comme matrice de modèle : mesh.vertices garde les
+    sommets d'origine. Avec transform_vertices=True les sommets sont calculés sur le CPU (un seul produit
+    (N,3)x(3,3) écrit dans un tampon préalloué) et écrits dans mesh.vertices.
+    """
+    transform = compose_transformations(rotation_mat, scaling_mat, projection_mat)
+    if not transform_vertices:
+        model_transform = np.eye(4)
+        model_transform[:3, :3] = transform
+        set_mesh_transform(mesh, model_transform)
+        if getattr(mesh, "cpu_transformed", False):
+            # Retour aux sommets d'origine après un passage par le CPU
+            mesh.vertices = np.copy(mesh.original_vertices)
+            mesh.cpu_transformed = False
+        return
 
-def main():
+    set_mesh_transform(mesh, None)
+    buffer = get_transform_buffer(mesh)
+    np.matmul(mesh.original_vertices, transform.T, out=buffer)
+    mesh.vertices = buffer
+    mesh.cpu_transformed = True
+
+def main(idle=False):
     pr.init_window(1000, 800, "3D Viewer with Rotation, Scaling, and Projection Control")
     pr.set_window_min_size(800, 600)
     camera = initialize_camera()
@@ -145,7 +171,7 @@ def main():
     movement_speed = 0.1
 
     ply_file_path = "dolphin.ply"
-    mesh = load_ply_file(ply_file_path)
+    mesh, _ = load_cached_mesh(ply_file_path)  # Projeté depuis le cache disque après le premier lancement
     
     initialize_mesh_for_transforming(mesh)
 
@@ -156,8 +182,16 @@ def main():
     axis_z_ptr = pr.ffi.new('float *', 0.0)
     projection_ptr = pr.ffi.new('bool *', 0)
 
+    # Suivi des modifications : matrices et sommets ne sont recalculés que si un contrôle a changé
+    previous_state = None
+    cached_frames = 0
+    idle_mode = create_idle_mode(idle)
+
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed)
+        # P : enregistre le mesh tel qu'il est affiché (sommets transformés et normales)
+        if pr.is_key_pressed(pr.KEY_P):
+            export_mesh(mesh, "dolphin_transforme.ply", with_normals=True)
         
         pr.begin_drawing()
         pr.clear_background(pr.RAYWHITE)
@@ -167,12 +201,20 @@ def main():
         axis = Vector3(axis_x_ptr[0], axis_y_ptr[0], axis_z_ptr[0])
         angle = angle_ptr[0]
         scale_factor = scale_factor_ptr[0]
+        state = (scale_factor, angle, axis.x, axis.y, axis.z, bool(projection_ptr[0]))
         
-        rotation_mat = rotation_matrix(axis, np.radians(angle))
-        scaling_mat = scaling_matrix(axis, scale_factor)
-        projection_mat = np.eye(3)
-        if projection_ptr[0]:
-            projection_mat = orthographic_projection_matrix(axis)
+        if state != previous_state:
+            rotation_mat = rotation_matrix(axis, np.radians(angle))
+            scaling_mat = scaling_matrix(axis, scale_factor)
+            projection_mat = np.eye(3)
+            if projection_ptr[0]:
+                projection_mat = orthographic_projection_matrix(axis)
+            apply_transformations(mesh, rotation_mat, scaling_mat, projection_mat)
+            previous_state = state
+            changed = True
+        else:
+            changed = False
+            cached_frames += 1
             
         # Dessiner les axes de coordonnées standard
         draw_coordinate_axes(Vector3(0, 0, 0), scale=3)
@@ -182,10 +224,8 @@ def main():
         # Tracer l'axe de transformation à partir de l'origine
         draw_transformation_axis(Vector3(0, 0, 0), axis, scale=3)            
         
-        apply_transformations(mesh, rotation_mat, scaling_mat, projection_mat)
-        
         draw_plane(axis, 10)
-        draw_mesh(mesh)
+        draw_mesh(mesh, camera=camera)
         pr.end_mode_3d()
 
         pr.draw_text("Échelle:", 750, 50, 20, pr.BLACK)
@@ -203,9 +243,15 @@ def main():
         pr.draw_text("Projection orthographique:", 750, 350, 20, pr.BLACK)
         pr.gui_check_box(pr.Rectangle(750, 380, 20, 20), "Activer", projection_ptr)
 
+        pr.draw_text("P : exporter le mesh transformé (dolphin_transforme.ply)", 10, 740, 20, pr.DARKGRAY)
+        pr.draw_text(f"Images servies depuis le cache : {cached_frames}", 10, 770, 20, pr.DARKGRAY)
+
         pr.end_drawing()
+        wait_if_idle(idle_mode, changed)
 
+    unload_mesh_model(mesh)
+    unload_instancing_resources()
     pr.close_window()
 
 if __name__ == "__main__":
-    main()
+    main(idle="--idle" in sys.argv)
@@ -0,0 +1,61 @@
+"""Vérifications du graphe de scène de tp3_exo2 (lancer avec python -m pytest)."""
+import numpy as np
+import trimesh
+from pyray import Vector3
+
+from tp3_exo1 import (apply_transformations_homogeneous, initialize_mesh_for_transforming,
+                      orthographic_projection_matrix_homogeneous, rotation_matrix_homogeneous, translation_matrix)
+from tp3_exo2 import (create_orbit_scene, create_orbits, get_world_instances, get_world_transform,
+                      orbit_local_transforms, prepare_orbits, set_instance_transforms, update_orbit_scene)
+
+
+def test_central_cube_matches_baseline_transform():
+    """Le cube central doit garder la transformation d'origine (rotation @ translation, sans projection)."""
+    mesh = trimesh.creation.box()
+    initialize_mesh_for_transforming(mesh)
+    central_transform = translation_matrix(1.5, -2.0, 0.5)
+    central_rotation = rotation_matrix_homogeneous(Vector3(0.3, 1.0, -0.2), np.radians(40))
+    projection_mat = orthographic_projection_matrix_homogeneous(Vector3(0, 1, 0), -20)
+
+    scene = create_orbit_scene(mesh)
+    update_orbit_scene(scene, central_transform, central_rotation, projection_mat)
+    world = get_world_transform(scene["central"])
+
+    # Version d'origine : sommets transformés sur le CPU, sans projection pour le cube central
+    apply_transformations_homogeneous(mesh, central_transform, central_rotation, np.eye(4), np.eye(4),
+                                      transform_vertices=True)
+    vertices = np.hstack((mesh.original_vertices, np.ones((len(mesh.original_vertices), 1)))) @ world.T
+    np.testing.assert_allclose(vertices[:, :3], np.asarray(mesh.vertices), atol=1e-12)
+
+
+def test_orbit_cubes_match_baseline_transform():
+    """Chaque cube orbital garde la composition d'origine : projection @ échelle @ rotation propre @ (CT @ CR @ OT)."""
+    mesh = trimesh.creation.box()
+    initialize_mesh_for_transforming(mesh)
+    central_transform = translation_matrix(1.5, -2.0, 0.5)
+    central_rotation = rotation_matrix_homogeneous(Vector3(0.3, 1.0, -0.2), np.radians(40))
+    projection_mat = orthographic_projection_matrix_homogeneous(Vector3(0, 1, 0), -20)
+    orbits = create_orbits(4, np.random.RandomState(0))
+    time, orbit_radius = 2.5, 3.0
+
+    scene = create_orbit_scene(mesh)
+    update_orbit_scene(scene, central_transform, central_rotation, projection_mat)
+    # Moins de cubes affichés que d'orbites préparées, comme dans main
+    set_instance_transforms(scene["orbits"], orbit_local_transforms(prepare_orbits(orbits), time, orbit_radius, 3,
+                                                                    frame=central_transform @ central_rotation))
+    worlds = get_world_instances(scene["orbits"])
+    assert len(worlds) == 3
+
+    for orbit, world in zip(orbits, worlds):
+        # Version d'origine, cube par cube sur le CPU
+        angle = time * (1 if orbit["clockwise"] else -1) + orbit["angle_offset"]
+        orbit_rotation = rotation_matrix_homogeneous(Vector3(*orbit["rotation_axis"]), angle)
+        orbit_translation = translation_matrix(np.cos(time + orbit["angle_offset"]) * orbit_radius + orbit["radius"],
+                                               np.sin(orbit["inclination"]) * orbit_radius + orbit["radius"],
+                                               np.sin(time + orbit["angle_offset"]) * orbit_radius + orbit["radius"])
+        scaling = np.diag([orbit["k"], orbit["k"], orbit["k"], 1.0])
+        apply_transformations_homogeneous(mesh, central_transform @ central_rotation @ orbit_translation,
+                                          orbit_rotation, scaling, projection_mat, transform_vertices=True)
+        vertices = np.hstack((mesh.original_vertices, np.ones((len(mesh.original_vertices), 1)))) @ world.T
+        # L'axe d'origine est normalisé en float32 par vector_normalize, d'où la tolérance
+        np.testing.assert_allclose(vertices[:, :3], np.asarray(mesh.vertices), atol=1e-6)
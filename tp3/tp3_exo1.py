@@ -1,9 +1,16 @@
 import pyray as pr
+import sys
+import os
 import numpy as np
 import math
 from pyray import Vector3
-import trimesh
 from  exo3 import cross_product , vector_length, vector_normalize, dot_product
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import load_cached_mesh, draw_mesh_model, draw_mesh_wireframe, draw_mesh_markers
+from outils3d import unload_mesh_model, unload_instancing_resources
+from outils3d import create_idle_mode, wait_if_idle, set_mesh_transform, export_mesh
+from outils3d import pick_mesh_with_mouse, draw_selection
 
 
 def initialize_camera():
@@ -80,26 +87,13 @@ def draw_transformation_axis(origin, axis, scale=3):
     scaled_axis = Vector3(origin.x + axis.x * scale, origin.y + axis.y * scale, origin.z + axis.z * scale)
     draw_vector_3(origin, scaled_axis, pr.PURPLE, thickness=0.05)
 
-def draw_mesh(mesh,color=pr.LIGHTGRAY):
+def draw_mesh(mesh,color=pr.LIGHTGRAY, camera=None):
     """Dessine le mesh complet avec sommets, arêtes et faces."""
-    for face in mesh.faces:
-        v0 = Vector3(*mesh.vertices[face[0]])
-        v1 = Vector3(*mesh.vertices[face[1]])
-        v2 = Vector3(*mesh.vertices[face[2]])
-        pr.draw_triangle_3d(v0, v1, v2, color)
+    draw_mesh_model(mesh, color)
     
-    for edge in mesh.edges:
-        v_start = Vector3(*mesh.vertices[edge[0]])
-        v_end = Vector3(*mesh.vertices[edge[1]])
-        pr.draw_line_3d(v_start, v_end, pr.BLACK)
+    draw_mesh_wireframe(mesh, pr.BLACK)
     
-    for vertex in mesh.vertices:
-        pr.draw_sphere(Vector3(*vertex), 0.05, pr.RED)
-
-def load_ply_file(file_path):
-    """Charge un fichier PLY et retourne le mesh en tant que structure de données trimesh."""
-    mesh = trimesh.load(file_path)
-    return mesh
+    draw_mesh_markers(mesh, 0.05, pr.RED, camera)
 
 def rotation_matrix_homogeneous(axis, theta):
     """Génère une matrice homogène de rotation autour d'un axe arbitraire (4x4)."""
@@ -161,17 +155,60 @@ def perspective_projection_matrix( d):
             [0,       0,   1/d,     0]
         ])
 
-def apply_transformations_homogeneous(mesh, translation_mat, rotation_mat, scaling_mat, projection_mat):
-    """Applique les transformations de rotation, de mise à l'échelle et de projection aux sommets du mesh en utilisant des matrices 4x4."""
-    vertices_homogeneous = np.hstack((mesh.original_vertices, np.ones((mesh.original_vertices.shape[0], 1))))
-    transformed_vertices = vertices_homogeneous @ translation_mat.T @ rotation_mat.T @ scaling_mat.T @ projection_mat.T
-    mesh.vertices = transformed_vertices[:, :3] / transformed_vertices[:, 3, np.newaxis]  # Revenir aux coordonnées 3D
+def compose_transformations_homogeneous(translation_mat, rotation_mat, scaling_mat, projection_mat):
+    """Compose les matrices 4x4 dans l'ordre d'application (translation, rotation, échelle, projection)."""
+    return projection_mat @ scaling_mat @ rotation_mat @ translation_mat
+
+def get_transform_buffers(mesh):
+    """
+    Retourne les tampons réutilisés d'une image à l'autre : copie homogène (N,4) de original_vertices,
+    résultat homogène (N,4) et sommets 3D (N,3). Ils ne sont recréés que si original_vertices change.
+    """
+    buffers = getattr(mesh, "transform_buffers", None)
+    if buffers is None or buffers["source"] is not mesh.original_vertices:
+        count = len(mesh.original_vertices)
+        homogeneous = np.ones((count, 4))
+        homogeneous[:, :3] = mesh.original_vertices
+        buffers = {
+            "source": mesh.original_vertices,
+            "homogeneous": homogeneous,
+            "transformed": np.empty((count, 4)),
+            "vertices": np.empty((count, 3)),
+        }
+        mesh.transform_buffers = buffers
+    return buffers
+
+def apply_transformations_homogeneous(mesh, translation_mat, rotation_mat, scaling_mat, projection_mat, transform_vertices=False):
+    """
+    Applique les transformations de rotation, de mise à l'échelle et de projection aux sommets du mesh en utilisant des matrices 4x4.
+
+    Une transformation affine (dernière ligne [0, 0, 0, 1]) est confiée au GPU comme matrice de modèle :
+    mesh.vertices garde les sommets d'origine et les données du GPU restent inchangées.
+    La projection en perspective (division par w) ou transform_vertices=True passent par le CPU :
+    un seul produit (N,4)x(4,4) écrit dans des tampons préalloués (voir get_transform_buffers).
+    """
+    transform = compose_transformations_homogeneous(translation_mat, rotation_mat, scaling_mat, projection_mat)
+    if not transform_vertices and np.array_equal(transform[3], [0, 0, 0, 1]):
+        set_mesh_transform(mesh, transform)
+        if getattr(mesh, "cpu_transformed", False):
+            # Retour aux sommets d'origine après un passage par le CPU
+            mesh.vertices = np.copy(mesh.original_vertices)
+            mesh.cpu_transformed = False
+        return
+
+    set_mesh_transform(mesh, None)
+    buffers = get_transform_buffers(mesh)
+    np.matmul(buffers["homogeneous"], transform.T, out=buffers["transformed"])
+    # Revenir aux coordonnées 3D
+    np.divide(buffers["transformed"][:, :3], buffers["transformed"][:, 3:], out=buffers["vertices"])
+    mesh.vertices = buffers["vertices"]
+    mesh.cpu_transformed = True
 
 def initialize_mesh_for_transforming(mesh):
     """Stocke les sommets originaux du mesh pour permettre un redimensionnement dynamique."""
     mesh.original_vertices = np.copy(mesh.vertices)
 
-def main():
+def main(idle=False):
     pr.init_window(1000, 900, "Visionneuse 3D avec contrôle de rotation, de mise à l'échelle et de projection")
     pr.set_window_min_size(800, 600)
     camera = initialize_camera()
@@ -180,7 +217,7 @@ def main():
 
     # Chargement du mesh et initialisation des transformations
     ply_file_path = "cube.ply"
-    mesh = load_ply_file(ply_file_path)
+    mesh, _ = load_cached_mesh(ply_file_path)  # Projeté depuis le cache disque après le premier lancement
     initialize_mesh_for_transforming(mesh)
 
     # Contrôles d'interface pour les transformations et translations
@@ -195,9 +232,18 @@ def main():
     
     d_ptr = pr.ffi.new('float *', 1.0)       # Paramètre de distance pour la projection en perspective
     projection_type_ptr = pr.ffi.new('float *', -1)  # Valeur par défaut (aucune projection)
+    selection = None
+
+    # Suivi des modifications : matrices et sommets ne sont recalculés que si un contrôle a changé
+    previous_state = None
+    cached_frames = 0
+    idle_mode = create_idle_mode(idle)
 
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed)
+        # P : enregistre le mesh tel qu'il est affiché (sommets transformés et normales)
+        if pr.is_key_pressed(pr.KEY_P):
+            export_mesh(mesh, "cube_transforme.ply", with_normals=True)
         
         pr.begin_drawing()
         pr.clear_background(pr.RAYWHITE)
@@ -206,33 +252,47 @@ def main():
         axis = Vector3(axis_x_ptr[0], axis_y_ptr[0], axis_z_ptr[0])
         angle = angle_ptr[0]
         scale_factor = scale_factor_ptr[0]
+        tx = translate_x_ptr[0]
+        ty = translate_y_ptr[0]
+        tz = translate_z_ptr[0]
+        state = (scale_factor, angle, axis.x, axis.y, axis.z, tx, ty, tz, projection_type_ptr[0], d_ptr[0])
         
-        # Création des matrices de transformation
-        rotation_mat = rotation_matrix_homogeneous(axis, np.radians(angle))
-        scaling_mat = scaling_matrix_homogeneous(axis, scale_factor)
-        
-        # Choix de la projection
-        projection_mat = np.eye(4)
-        if projection_type_ptr[0] > -1 and projection_type_ptr[0] < 1:
-            projection_mat = orthographic_projection_matrix_homogeneous(axis)
-        elif projection_type_ptr[0] == 1:
-            projection_mat = perspective_projection_matrix(d_ptr[0])
+        if state != previous_state:
+            # Création des matrices de transformation
+            rotation_mat = rotation_matrix_homogeneous(axis, np.radians(angle))
+            scaling_mat = scaling_matrix_homogeneous(axis, scale_factor)
+            
+            # Choix de la projection
+            projection_mat = np.eye(4)
+            if projection_type_ptr[0] > -1 and projection_type_ptr[0] < 1:
+                projection_mat = orthographic_projection_matrix_homogeneous(axis)
+            elif projection_type_ptr[0] == 1:
+                projection_mat = perspective_projection_matrix(d_ptr[0])
+            
+            translation_mat = translation_matrix(tx, ty, tz)
+            apply_transformations_homogeneous(mesh, translation_mat, rotation_mat, scaling_mat, projection_mat)
+            previous_state = state
+            changed = True
+        else:
+            changed = False
+            cached_frames += 1
         
         # Dessin des axes et du mesh
         draw_coordinate_axes(Vector3(0, 0, 0), scale=3)
         draw_transformation_axis(Vector3(0, 0, 0), axis, scale=3)
-
-        tx = translate_x_ptr[0]
-        ty = translate_y_ptr[0]
-        tz = translate_z_ptr[0]
-        translation_mat = translation_matrix(tx, ty, tz)
         
-        apply_transformations_homogeneous(mesh, translation_mat, rotation_mat, scaling_mat, projection_mat)
+        # Clic droit : sélection sur les sommets transformés (le clic gauche reste réservé aux curseurs)
+        if pr.is_mouse_button_pressed(pr.MOUSE_BUTTON_RIGHT):
+            selection = pick_mesh_with_mouse(mesh, camera)
         
         draw_plane(axis, 10)
-        draw_mesh(mesh)
+        draw_mesh(mesh, camera=camera)
+        draw_selection(mesh, selection)
         pr.end_mode_3d()
 
+        if selection is not None:
+            pr.draw_text(f"Face : {selection['face']}  Sommet : {selection['vertex']}", 10, 10, 20, pr.BLACK)
+
         # GUI de contrôle pour les transformations
         pr.draw_text("Échelle:", 750, 50, 20, pr.BLACK)
         pr.gui_slider_bar(pr.Rectangle(750, 80, 200, 20), "0.5", "10", scale_factor_ptr, 0.4, 10.0)
@@ -263,9 +323,15 @@ def main():
             pr.draw_text("Distance de projection:", 750, 610, 20, pr.BLACK)
             pr.gui_slider_bar(pr.Rectangle(750, 640, 200, 20), "1.0", "8.0", d_ptr, 1.0, 8.0)
 
+        pr.draw_text("P : exporter le mesh transformé (cube_transforme.ply)", 10, 840, 20, pr.DARKGRAY)
+        pr.draw_text(f"Images servies depuis le cache : {cached_frames}", 10, 870, 20, pr.DARKGRAY)
+
         pr.end_drawing()
+        wait_if_idle(idle_mode, changed)
 
+    unload_mesh_model(mesh)
+    unload_instancing_resources()
     pr.close_window()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(idle="--idle" in sys.argv)
\ No newline at end of file
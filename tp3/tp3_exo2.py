@@ -1,15 +1,18 @@
 import pyray as pr
+import sys
+import os
 import numpy as np
 from pyray import Vector3
 from  exo3 import cross_product , vector_length, vector_normalize, dot_product
+# Outils partagés par les TP (outils3d.py, à la racine du dépôt)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from outils3d import unload_mesh_model, unload_instancing_resources, load_cached_mesh
+from outils3d import create_idle_mode, wait_if_idle, set_mesh_transform, draw_mesh_instances
 from tp3_exo1 import scaling_matrix_homogeneous, orthographic_projection_matrix_homogeneous, perspective_projection_matrix
 # Importer les fonctions et utilitaires existants
 from tp3_exo1 import (
     initialize_camera,
     update_camera_position,
-    load_ply_file,
-    initialize_mesh_for_transforming,
-    apply_transformations_homogeneous,
     draw_mesh,
     rotation_matrix_homogeneous,
     translation_matrix
@@ -30,26 +33,246 @@ def draw_plane(axis, size=5, color=pr.GRAY):
         pr.draw_line_3d(start1, end1, color)
         pr.draw_line_3d(start2, end2, color)
 
-def scaling_matrix_isotropic(k):
+# État des orbites : un tableau structuré (une ligne par cube orbital) au lieu d'une liste de dictionnaires
+ORBIT_DTYPE = np.dtype([
+    ("angle_offset", np.float64),
+    ("inclination", np.float64),
+    ("rotation_axis", np.float64, (3,)),
+    ("clockwise", np.bool_),
+    ("radius", np.float64),
+    ("k", np.float64),
+])
+
+def create_orbits(count, rng=np.random):
+    """Tire au hasard l'état de count cubes orbitaux (mêmes distributions que la version par dictionnaires)."""
+    orbits = np.empty(count, dtype=ORBIT_DTYPE)
+    orbits["angle_offset"] = rng.uniform(0, 2 * np.pi, count)
+    orbits["inclination"] = rng.uniform(-np.pi / 4, np.pi / 4, count)
+    orbits["rotation_axis"] = rng.uniform(-1, 1, (count, 3))
+    orbits["clockwise"] = rng.choice([True, False], count)  # Rotation aléatoire (horaire ou antihoraire)
+    orbits["radius"] = rng.uniform(1, 2, count)
+    orbits["k"] = rng.uniform(0.1, 3, count)
+    return orbits
+
+def rotation_coefficients(nx, ny, nz, angles):
+    """
+    Coefficients (ligne par ligne) des matrices de rotation_matrix_homogeneous pour K axes unitaires
+    (nx, ny, nz de forme (K,)) et K angles : liste de 9 tableaux (K,).
+    """
+    cos_theta = np.cos(angles)
+    sin_theta = np.sin(angles)
+    one_minus_cos = 1 - cos_theta
+    xy, xz, yz = nx * ny * one_minus_cos, nx * nz * one_minus_cos, ny * nz * one_minus_cos
+    xs, ys, zs = nx * sin_theta, ny * sin_theta, nz * sin_theta
+    return [
+        nx * nx * one_minus_cos + cos_theta, xy - zs, xz + ys,
+        xy + zs, ny * ny * one_minus_cos + cos_theta, yz - xs,
+        xz - ys, yz + xs, nz * nz * one_minus_cos + cos_theta,
+    ]
+
+def prepare_orbits(orbits):
+    """
+    Extrait une fois pour toutes du tableau structuré les grandeurs constantes des orbites sous forme
+    de tableaux contigus (les champs d'un tableau structuré sont entrelacés, donc lents à parcourir),
+    avec les axes de rotation déjà normalisés (un axe nul reste nul, comme avec vector_normalize).
+    """
+    axes = orbits["rotation_axis"]
+    lengths = np.sqrt(np.einsum('ij,ij->i', axes, axes))
+    unit_axes = np.divide(axes, lengths[:, np.newaxis], out=np.zeros_like(axes), where=lengths[:, np.newaxis] != 0)
+    return {
+        "count": len(orbits),
+        "direction": np.where(orbits["clockwise"], 1.0, -1.0),
+        "angle_offset": np.ascontiguousarray(orbits["angle_offset"]),
+        "axes": np.ascontiguousarray(unit_axes.T),  # (3,K)
+        "sin_inclination": np.sin(orbits["inclination"]),
+        "radius": np.ascontiguousarray(orbits["radius"]),
+        "k": np.ascontiguousarray(orbits["k"]),
+        "rows": np.zeros((16, len(orbits))),  # Tampon des 16 coefficients, une ligne par coefficient
+        "scaled_rotations": np.zeros((3, 3, len(orbits))),  # Tampon des rotations propres mises à l'échelle
+    }
+
+def orbit_local_transforms(orbits, time, orbit_radius, count=None, out=None, frame=None):
+    """
+    Calcule en un seul lot les transformations (K,4,4) des cubes orbitaux avant projection, dans l'ordre
+    de la version d'origine : échelle isotrope @ rotation propre @ repère du cube central @ translation
+    orbitale. L'échelle et la rotation propre s'appliquent donc après le repère du cube central.
+
+    :param orbits: Orbites préparées par prepare_orbits (ou tableau structuré ORBIT_DTYPE).
+    :param time: Temps courant (pr.get_time()).
+    :param orbit_radius: Rayon d'orbite choisi par l'utilisateur.
+    :param count: Nombre K d'orbites à calculer (les premières) ; toutes si None.
+    :param out: Tableau (K,4,4) réutilisé d'une image à l'autre (alloué si None).
+    :param frame: Repère affine 4x4 du cube central (translation @ rotation) ; identité si None.
+    """
+    if isinstance(orbits, np.ndarray):
+        orbits = prepare_orbits(orbits)
+    if count is None:
+        count = orbits["count"]
+    if out is None:
+        out = np.empty((count, 4, 4))
+    angle_offset = orbits["angle_offset"][:count]
+    radius = orbits["radius"][:count]
+    k = orbits["k"][:count]
+    nx, ny, nz = orbits["axes"][:, :count]
+    rows = orbits["rows"][:, :count]
+    scaled_rotations = orbits["scaled_rotations"][:, :, :count]
+
+    # TODO : expliquer cette ligne en expérimentant et en lisant la documentation
+    angles = time * orbits["direction"][:count] + angle_offset
+
+    # Rotation autour de l'axe du cube, mise à l'échelle isotrope (la matrice d'échelle est k * identité)
+    for index, coefficient in enumerate(rotation_coefficients(nx, ny, nz, angles)):
+        np.multiply(coefficient, k, out=scaled_rotations[index // 3, index % 3])
+
+    """ Le mouvement se déroule principalement dans le plan xz, tandis 
+    que la coordonnée y introduit une inclinaison pour donner l'impression 
+    que l'orbite est inclinée dans l'espace 3D."""
+    phases = time + angle_offset
+    positions = np.array([np.cos(phases) * orbit_radius + radius,
+                          orbits["sin_inclination"][:count] * orbit_radius + radius,
+                          np.sin(phases) * orbit_radius + radius])
+
+    # Repère du cube central @ translation orbitale : partie linéaire du repère, translation déplacée
+    if frame is None:
+        frame = np.eye(4)
+    positions = frame[:3, :3] @ positions + frame[:3, 3:]
+
+    # Échelle @ rotation propre appliquées à gauche, écrites directement dans la vue (4,4,K) du tampon
+    matrices = rows.reshape(4, 4, count)
+    np.einsum('ilk,lj->ijk', scaled_rotations, frame[:3, :3], out=matrices[:3, :3])
+    np.einsum('ilk,lk->ik', scaled_rotations, positions, out=matrices[:3, 3])
+    matrices[3, :3] = 0.0
+    matrices[3, 3] = 1.0
+
+    # Une seule transposition vers le format (K,4,4)
+    np.copyto(out.reshape(count, 16), rows.T)
+    return out
+
+def create_scene_node(mesh=None, local_transform=None, parent=None, color=pr.LIGHTGRAY):
     """
-    Génère une matrice homogène de mise à l'échelle isotrope (4x4)
-    autour d'un axe arbitraire dans l'espace 3D.
+    Crée un nœud du graphe de scène. Le mesh est partagé (jamais modifié) : le nœud ne fait que
+    le référencer et le dessine avec sa matrice monde comme matrice de modèle.
+
+    :param mesh: Mesh à dessiner, ou None pour un nœud de regroupement.
+    :param local_transform: Matrice 4x4 relative au parent (identité si None).
+    :param parent: Nœud parent, ou None pour une racine.
+    :param color: Couleur des faces du mesh.
+    :return: Dictionnaire représentant le nœud.
+
+    Un nœud peut aussi porter un lot d'instances (voir set_instance_transforms) : le mesh est alors
+    dessiné une fois par matrice (K,4,4), relative au repère du nœud, en rendu instancié.
     """
-    return np.array([
-        [k, 0, 0, 0],
-        [0, k, 0, 0],
-        [0, 0, k, 0],
-        [0, 0, 0, 1]
-    ])
-
-def main():
+    node = {
+        "mesh": mesh,
+        "color": color,
+        "local": np.eye(4) if local_transform is None else np.array(local_transform, dtype=np.float64),
+        "world": np.eye(4),
+        "dirty": True,
+        "instances": None,
+        "world_instances": None,
+        "instances_dirty": True,
+        "visible": True,
+        "parent": None,
+        "children": [],
+    }
+    if parent is not None:
+        add_child(parent, node)
+    return node
+
+def add_child(parent, child):
+    """Rattache child à parent ; sa matrice monde devra être recalculée."""
+    child["parent"] = parent
+    parent["children"].append(child)
+    mark_subtree_dirty(child)
+
+def mark_subtree_dirty(node):
+    """
+    Marque le nœud et ses descendants comme à recalculer. Un nœud déjà marqué a forcément tous ses
+    descendants marqués (un enfant ne peut être recalculé qu'après son parent) : on s'y arrête.
+    """
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current["dirty"] and current is not node:
+            continue
+        current["dirty"] = True
+        current["instances_dirty"] = True
+        stack.extend(current["children"])
+
+def set_local_transform(node, local_transform):
+    """Change la matrice locale du nœud ; le sous-arbre n'est invalidé que si elle a réellement changé."""
+    if np.array_equal(node["local"], local_transform):
+        return
+    node["local"] = np.array(local_transform, dtype=np.float64)
+    mark_subtree_dirty(node)
+
+def set_instance_transforms(node, transforms):
+    """Remplace le lot (K,4,4) des matrices d'instances du nœud (relatives à son repère)."""
+    node["instances"] = transforms
+    node["instances_dirty"] = True
+
+def get_world_instances(node):
+    """Retourne les matrices monde (K,4,4) des instances du nœud, calculées en un seul produit par lot."""
+    if node["instances_dirty"]:
+        node["world_instances"] = np.matmul(get_world_transform(node), node["instances"])
+        node["instances_dirty"] = False
+    return node["world_instances"]
+
+def get_world_transform(node):
+    """Retourne la matrice monde du nœud, recalculée seulement si lui ou un ancêtre a changé."""
+    if node["dirty"]:
+        parent = node["parent"]
+        node["world"] = node["local"] if parent is None else get_world_transform(parent) @ node["local"]
+        node["dirty"] = False
+    return node["world"]
+
+def draw_scene_graph(root, camera=None):
+    """Dessine tous les nœuds visibles portant un mesh ; les sous-arbres invisibles ne sont pas recalculés."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if not node["visible"]:
+            continue
+        if node["mesh"] is not None and node["instances"] is not None:
+            # Toutes les instances du nœud en un seul lot d'appels instanciés
+            draw_mesh_instances(node["mesh"], get_world_instances(node), node["color"], camera)
+        elif node["mesh"] is not None:
+            set_mesh_transform(node["mesh"], get_world_transform(node))
+            draw_mesh(node["mesh"], node["color"], camera)
+        stack.extend(reversed(node["children"]))
+
+def create_orbit_scene(mesh):
+    """
+    Construit le graphe de scène de la démo, tous les nœuds partageant le même mesh :
+    racine -> cube central (sans projection, comme dans la version d'origine)
+           -> projection -> lot des cubes orbitaux. Le repère du cube central est inclus dans les
+    matrices des instances (voir orbit_local_transforms) : dans la version d'origine, l'échelle et la
+    rotation propre de chaque cube s'appliquent après ce repère, qui ne peut donc pas être un nœud parent.
+
+    :return: Dictionnaire des nœuds {"root", "central", "projection", "orbits"}.
+    """
+    root = create_scene_node()
+    central = create_scene_node(mesh, parent=root, color=pr.RED)
+    projection = create_scene_node(parent=root)
+    orbits = create_scene_node(mesh, parent=projection)
+    return {"root": root, "central": central, "projection": projection, "orbits": orbits}
+
+def update_orbit_scene(scene, central_transform, central_rotation, projection_mat):
+    """
+    Met à jour les matrices locales du graphe ; seuls les sous-arbres dont la matrice a changé sont invalidés.
+    Le cube central reçoit rotation @ translation (ordre de apply_transformations_homogeneous) ; les cubes
+    orbitaux sont projetés, leur repère translation @ rotation est passé à orbit_local_transforms.
+    """
+    set_local_transform(scene["central"], central_rotation @ central_transform)
+    set_local_transform(scene["projection"], projection_mat)
+
+def main(idle=False):
     pr.init_window(1000, 900, "Cube central tournant avec cubes orbitaux")
     pr.set_target_fps(60)
 
     # Charger l'objet central
     mesh_file = "cube.ply"  # Remplacez par le chemin réel vers votre fichier PLY
-    mesh = load_ply_file(mesh_file)
-    initialize_mesh_for_transforming(mesh)
+    mesh, _ = load_cached_mesh(mesh_file)  # Projeté depuis le cache disque après le premier lancement
 
     # Contrôles GUI
     translate_x_ptr = pr.ffi.new('float *', 0.0)
@@ -67,26 +290,19 @@ def main():
     
     
     
-    # Créer une liste de cubes orbitaux
-    max_orbits = 50
-    orbit_cubes = []
-    for _ in range(max_orbits):
-        orbit_cubes.append({
-            "transform": np.eye(4),
-            "angle_offset": np.random.uniform(0, 2 * np.pi),
-            "inclination": np.random.uniform(-np.pi / 4, np.pi / 4),
-            "rotation_axis": Vector3(
-                np.random.uniform(-1, 1),
-                np.random.uniform(-1, 1),
-                np.random.uniform(-1, 1)
-            ),
-            "clockwise": np.random.choice([True, False]),  # Rotation aléatoire (horaire ou antihoraire)
-            "radius": np.random.uniform(1,2),
-            "k": np.random.uniform(0.1,3)
-            
-        })
+    # Créer les cubes orbitaux (tableau structuré, voir ORBIT_DTYPE)
+    # Plafond mesuré : jusqu'à 20 000 cubes, calcul des matrices et préparation du rendu instancié
+    # restent sous ~9 ms par image (60 images/s) ; à 100 000 il faut ~45 ms
+    max_orbits = 20_000
+    orbits = prepare_orbits(create_orbits(max_orbits))
+    orbit_transforms = np.zeros((max_orbits, 4, 4))
+
+    # Graphe de scène : cube central et lot des cubes orbitaux, tous partagent le même mesh
+    scene = create_orbit_scene(mesh)
+    orbit_node = scene["orbits"]
     
     camera = initialize_camera()
+    idle_mode = create_idle_mode(idle)
 
     while not pr.window_should_close():
         update_camera_position(camera, movement_speed = 0.1)
@@ -104,11 +320,6 @@ def main():
         rotation_axis = Vector3(axis_x_ptr[0], axis_y_ptr[0], axis_z_ptr[0])
         angle= rotation_angle_ptr[0]
         central_rotation = rotation_matrix_homogeneous(rotation_axis, np.radians(angle))
-        
-
-        # Dessiner le cube central
-        apply_transformations_homogeneous(mesh, central_transform, central_rotation, np.eye(4), np.eye(4))
-        draw_mesh(mesh,pr.RED)
 
         # Dessine le plan 
         draw_plane(Vector3(0,1,0), 50)
@@ -117,33 +328,20 @@ def main():
         projection_mat=np.eye(4)
         if projection_ptr[0]:
             projection_mat = orthographic_projection_matrix_homogeneous(Vector3(0,1,0),-20)
+        # Seuls les nœuds dont la matrice a changé sont invalidés
+        update_orbit_scene(scene, central_transform, central_rotation, projection_mat)
             
-            
-        # Dessiner les cubes orbitaux
-        for i in range(round(orbit_count_ptr[0])):
-            orbit = orbit_cubes[i]
-            # TODO : expliquer cette ligne en expérimentant et en lisant la documentation
-            angle = pr.get_time() * (1 if orbit["clockwise"] else -1) + orbit["angle_offset"]
-
-            # Rotation autour de l'axe du cube
-            orbit_rotation = rotation_matrix_homogeneous(orbit["rotation_axis"], angle)
-
-            # Transformation du cube orbital relative au cube central
-            """ Le mouvement se déroule principalement dans le plan xz, tandis 
-            que la coordonnée y introduit une inclinaison pour donner l'impression 
-            que l'orbite est inclinée dans l'espace 3D."""
-            # Transformation orbitale
-            orbit_x = np.cos(pr.get_time() + orbit["angle_offset"]) * orbit_radius_ptr[0]+orbit["radius"]
-            orbit_y = np.sin(orbit["inclination"])                  * orbit_radius_ptr[0]+orbit["radius"]
-            orbit_z = np.sin(pr.get_time() + orbit["angle_offset"]) * orbit_radius_ptr[0]+orbit["radius"]
-            orbit_translation = translation_matrix(orbit_x, orbit_y, orbit_z)
-            
-            # Appliquer la rotation du cube central
-            combined_transform = central_transform @ central_rotation @ orbit_translation          
+        # Mise à jour des cubes orbitaux : un seul calcul par lot (K,4,4) pour les K cubes affichés
+        orbit_count = round(orbit_count_ptr[0])
+        orbit_node["visible"] = orbit_count > 0
+        if orbit_node["visible"]:
+            local_transforms = orbit_local_transforms(orbits, pr.get_time(), orbit_radius_ptr[0], orbit_count,
+                                                      out=orbit_transforms[:orbit_count],
+                                                      frame=central_transform @ central_rotation)
+            set_instance_transforms(orbit_node, local_transforms)
 
-            apply_transformations_homogeneous(mesh, combined_transform, orbit_rotation, scaling_matrix_isotropic(orbit["k"]), projection_mat)
-                        
-            draw_mesh(mesh)
+        # Dessiner le cube central et les cubes orbitaux
+        draw_scene_graph(scene["root"], camera)
             
         pr.end_mode_3d()
 
@@ -164,7 +362,7 @@ def main():
         pr.draw_text("Angle de Rotation:", 10, 340, 20, pr.BLACK)
         pr.gui_slider_bar(pr.Rectangle(10, 360, 200, 20), "0", "360", rotation_angle_ptr, 0.0, 360.0)
         pr.draw_text("Cubes Orbitaux:", 10, 400, 20, pr.BLACK)
-        pr.gui_slider_bar(pr.Rectangle(10, 420, 200, 20), "0", "50", orbit_count_ptr, 0, max_orbits)
+        pr.gui_slider_bar(pr.Rectangle(10, 420, 200, 20), "0", str(max_orbits), orbit_count_ptr, 0, max_orbits)
         pr.draw_text("Rayon d'Orbite:", 10, 440, 20, pr.BLACK)
         pr.gui_slider_bar(pr.Rectangle(10, 460, 200, 20), "0", "10", orbit_radius_ptr, 0, 10)
         pr.draw_text("Projection orthographique:", 10, 480, 20, pr.BLACK)
@@ -173,8 +371,12 @@ def main():
         pr.gui_check_box(pr.Rectangle(10, 550, 20, 20), "Activer", pers_ptr)
 
         pr.end_drawing()
+        # Les cubes orbitaux sont animés : pas de repos tant qu'il y en a à l'écran
+        wait_if_idle(idle_mode, round(orbit_count_ptr[0]) > 0)
 
+    unload_mesh_model(mesh)
+    unload_instancing_resources()
     pr.close_window()
 
 if __name__ == "__main__":
-    main()
+    main(idle="--idle" in sys.argv)